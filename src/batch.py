@@ -1,10 +1,15 @@
 import os
+import sys
 import time
-import subprocess
+import traceback
 from itertools import product
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import random
-import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from environment import Environment, SharedArrays
+from main import parse_movement_strategy, parse_engine, parse_renderer
+from results import ResultsStore, RESULTS_FILENAME
+from simulation import run_simulation
+from visualization import GenericVisualization, ResultsVisualization, VideoVisualization
 
 # --- User parameters ---
 NUM_ITERATIONS = 1
@@ -13,8 +18,13 @@ FPS = 10
 SPAWN_PERCENT = 0.75
 FRAMES = False
 VIDEO = False
+RENDERER = "raster"  # "raster" (fast) or "matplotlib"
 MAX_PARALLEL = 8
-PYTHON_EXEC = "python"  # path to python interpreter
+ENGINE = "python"  # "python" or "numpy"
+# Run the iterations of each scenario together as replicates of one array computation
+# (always the numpy engine). Replicates cannot be filmed, so this cannot be combined
+# with VIDEO; the batch refuses to start rather than silently skip the videos.
+REPLICATE_BATCHES = False
 
 MOVEMENT = ["static"]
 ENVIRONMENT = ["env1"]
@@ -23,74 +33,174 @@ UPDATE_INTERVALS = ["10"]
 STRATEGY_INERTIA = ["0.1"]
 DEFECT_PUNISHMENT = ["2.0"]
 FAMILIARITY = 200
+BATCH_SEED = None  # set to an int to reproduce a whole batch
+# Runs that never finish are cut short and recorded with why they stopped
+MAX_STEPS = 100_000
+STALL_STEPS = 1000  # steps with no escapes and nobody moving, or nobody left able to reach an exit
+TIMEOUT = 3600  # seconds of wall time per simulation
+# Finished runs written to the results database per transaction
+RESULTS_BATCH_SIZE = 64
 
 jobs = list(product(
     MOVEMENT, ENVIRONMENT, COOPERATE_PERCENTS, UPDATE_INTERVALS, STRATEGY_INERTIA, DEFECT_PUNISHMENT, range(
         NUM_ITERATIONS)
 ))
 
+# One independent seed per job, spawned from a single root so runs never share streams
+seed_sequence = np.random.SeedSequence(BATCH_SEED)
+job_seeds = [int(child.generate_state(1, np.uint64)[0])
+             for child in seed_sequence.spawn(len(jobs))]
+jobs = [job + (seed,) for job, seed in zip(jobs, job_seeds)]
+
 total_sims = len(jobs)
 start_time = time.time()
 completed = 0
-completed_lock = threading.Lock()  # Thread-safe counter
 
+# Environments loaded by this worker process, reused by every job it runs
+environments: dict[str, Environment] = {}
+# The environments the parent published in shared memory, by name
+shared_environments: dict[str, SharedArrays] = {}
 
-def run_one_sim(movement: str, env: str, coop: str, update: str, inertia: str, defect_punishment: str, iteration: int) -> float:
-    global completed, total_sims
 
-    out_dir = os.path.join(
+def attach_environments(shared: dict[str, SharedArrays]):
+    """Worker initializer: attaches to the environments the parent published"""
+    shared_environments.update(shared)
+
+
+def job_out_dir(movement: str, env: str, coop: str, update: str, inertia: str, defect_punishment: str, iteration: int) -> str:
+    """Where a job's video and frames go; every other result goes into the results database"""
+    return os.path.join(
         OUT_DIR, movement, env, f"coop_{coop}",
         f"update_{update}", f"strat_inertia_{inertia}", f"defect_punishment_{defect_punishment}",
         f"iter_{iteration}"
     )
 
-    json_path = os.path.join(out_dir, "out.json")
-    if os.path.exists(json_path):
-        with completed_lock:
-            total_sims -= 1
-        print_eta()
-        return 0  # skipped job
 
-    os.makedirs(out_dir, exist_ok=True)
-    out_dir = os.path.abspath(out_dir)
+def job_key(job: tuple) -> tuple:
+    """The ResultsStore key of a job"""
+    movement, env_name, coop, update, inertia, defect_punishment, iteration, _ = job
+    return env_name, movement, float(coop), int(update), float(inertia), float(defect_punishment), iteration
+
+
+def result_row(job: tuple, engine: str, seconds: float, command: str, results: ResultsVisualization,
+               seed: int | None = None, replicate: int | None = None) -> dict:
+    """
+    The ResultsStore row of a finished job. Replicates pass the seed their
+    whole group ran on and their index in it, instead of the job's own seed.
+    """
+    movement, env_name, coop, update, inertia, defect_punishment, iteration, job_seed = job
+    return {
+        "environment": env_name, "movement": movement, "engine": engine, "spawn_percent": SPAWN_PERCENT,
+        "coop": float(coop), "update_interval": int(update), "inertia": float(inertia),
+        "p_value": float(defect_punishment), "familiarity": FAMILIARITY, "iteration": iteration,
+        "seed": job_seed if seed is None else seed, "replicate": replicate,
+        "seconds": seconds, "command": command, **results.result()
+    }
 
+
+def load_environment(env_name: str) -> Environment:
+    """
+    Returns this worker's environment, emptied of people from earlier runs.
+    Its terrain, static field and neighbour tables are read from shared memory
+    when the parent published them.
+    """
+    if env_name not in environments:
+        shared = shared_environments.get(env_name)
+        environments[env_name] = Environment(shared=shared) if shared is not None else Environment(env_name)
+    env = environments[env_name]
+    env.reset()
+    return env
+
+
+def run_one_sim(movement: str, env_name: str, coop: str, update: str, inertia: str, defect_punishment: str, iteration: int, seed: int) -> list[dict]:
+    """
+    Runs one simulation inside a worker process.
+    Returns its results row.
+    """
+    # Equivalent main.py command, for rerunning a single job by hand
     cmd = [
-        PYTHON_EXEC, "main.py",
-        f"--env={env}",
+        "python", "main.py",
+        f"--env={env_name}",
         f"--movement={movement}",
-        f"--json={os.path.join(out_dir, 'out.json')}",
+        f"--engine={ENGINE}",
         f"--spawn_percent={SPAWN_PERCENT}",
         f"--cooperate_percent={coop}",
         f"--update_interval={update}",
         f"--strategy_inertia={inertia}",
         f"--familiarity={FAMILIARITY}",
         f"--p_value={defect_punishment}",
-        f"--seed={random.randint(0, 1_000_000)}"
+        f"--seed={seed}",
+        f"--max_steps={MAX_STEPS}",
+        f"--stall_steps={STALL_STEPS}",
+        f"--timeout={TIMEOUT}"
     ]
-
+    results = ResultsVisualization()
+    visualizers: list[GenericVisualization] = [results]
     if VIDEO:
+        out_dir = os.path.abspath(job_out_dir(
+            movement, env_name, coop, update, inertia, defect_punishment, iteration))
+        os.makedirs(out_dir, exist_ok=True)
         cmd += [
             f"--video={os.path.join(out_dir, 'out.mp4')}",
             f"--fps={FPS}",
-            f"--frames={FRAMES}"
+            f"--frames={FRAMES}",
+            f"--renderer={RENDERER}"
         ]
-
-    # write command to a file for debugging
-    with open(os.path.join(out_dir, "command.txt"), "w") as f:
-        f.write(" ".join(cmd) + "\n")
+        visualizers.append(VideoVisualization(
+            filename=os.path.join(out_dir, "out.mp4"),
+            fps=FPS,
+            export_frames=FRAMES,
+            verbose=False,
+            renderer=parse_renderer(RENDERER),
+            workers=1  # the batch already runs one simulation per CPU
+        ))
 
     start = time.time()
-    result = subprocess.run(cmd, capture_output=True)
+    env = load_environment(env_name)
+    movement_strategy = parse_movement_strategy(movement)
+    run_simulation(movement_strategy=movement_strategy, env=env,
+                   visualizers=visualizers, spawn_percent=SPAWN_PERCENT,
+                   cooperate_percent=float(coop),
+                   verbose=False, update_interval=int(update), strategy_inertia=float(inertia),
+                   familiarity=FAMILIARITY, p_value=float(defect_punishment),
+                   engine=parse_engine(ENGINE), rng=np.random.default_rng(seed),
+                   max_steps=MAX_STEPS, stall_steps=STALL_STEPS, timeout=TIMEOUT)
+    job = (movement, env_name, coop, update, inertia, defect_punishment, iteration, seed)
+    return [result_row(job, ENGINE, time.time() - start, " ".join(cmd), results)]
 
-    if result.returncode != 0:
-        raise RuntimeError(
-            f"Simulation failed with return code {result.returncode}")
 
-    with completed_lock:
-        completed += 1
+def run_replicate_sims(group: list[tuple]) -> list[dict]:
+    """
+    Runs the iterations of one scenario as replicates advanced together.
+    Returns a results row per replicate, each charged an equal share of the wall time.
+    """
+    movement, env_name, coop, update, inertia, defect_punishment, _, seed = group[0]
+    movement_strategy = parse_movement_strategy(movement)
+    visualizers = [ResultsVisualization() for _ in group]
+
+    start = time.time()
+    run_simulation(movement_strategy=movement_strategy, env=load_environment(env_name),
+                   visualizers=visualizers, spawn_percent=SPAWN_PERCENT,  # type: ignore
+                   cooperate_percent=float(coop),
+                   verbose=False, update_interval=int(update), strategy_inertia=float(inertia),
+                   familiarity=FAMILIARITY, p_value=float(defect_punishment),
+                   rng=np.random.default_rng(seed), replicates=len(group),
+                   max_steps=MAX_STEPS, stall_steps=STALL_STEPS, timeout=TIMEOUT)
+    seconds = (time.time() - start) / len(group)
+    return [result_row(job, "numpy", seconds, f"replicate {replicate} of {len(group)} run together with seed {seed}",
+                       results, seed=seed, replicate=replicate)
+            for replicate, (job, results) in enumerate(zip(group, visualizers))]
 
-    print_eta()
-    return time.time() - start
+
+def run_job(group: list[tuple]) -> list[dict]:
+    """Worker entry point; failures come back to the parent with their full traceback"""
+    try:
+        if len(group) > 1:
+            return run_replicate_sims(group)
+        return run_one_sim(*group[0])
+    except Exception as e:
+        raise RuntimeError(
+            f"Simulation {[job[:-1] for job in group]} failed:\n{traceback.format_exc()}") from e
 
 
 def print_eta():
@@ -113,23 +223,75 @@ def print_eta():
 
 
 def main():
-    print(f"Total simulations to run: {total_sims}")
+    global completed, total_sims
+
+    if REPLICATE_BATCHES and VIDEO:
+        print("REPLICATE_BATCHES cannot record videos; turn off VIDEO or REPLICATE_BATCHES")
+        sys.exit(1)
+
+    store = ResultsStore(os.path.join(OUT_DIR, RESULTS_FILENAME))
+    # Skip jobs that already have results
+    done = store.keys()
+    pending = [job for job in jobs if job_key(job) not in done]
+    total_sims = len(pending)
+
+    print(f"Total simulations to run: {total_sims} ({len(jobs) - total_sims} already done)")
+    print(f"Batch seed: {seed_sequence.entropy}")
     print(f"Running {MAX_PARALLEL} jobs in parallel\n")
 
-    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as executor:
-        future_to_job = {executor.submit(
-            run_one_sim, *job): job for job in jobs}
-        for future in as_completed(future_to_job):
+    if REPLICATE_BATCHES:
+        # Group the pending iterations of each scenario into one task
+        groups: dict[tuple, list[tuple]] = {}
+        for job in pending:
+            groups.setdefault(job[:6], []).append(job)
+        tasks = list(groups.values())
+    else:
+        tasks = [[job] for job in pending]
+
+    failed = 0
+    # The workers hand their rows back and this process alone writes them,
+    # many runs per transaction
+    rows: list[dict] = []
+    # Every worker reads the same copy of each environment. Each block is
+    # unlinked below even if loading a later environment fails.
+    shared: dict[str, SharedArrays] = {}
+    try:
+        for env_name in {job[1] for job in pending}:
+            shared[env_name] = Environment(env_name).share()
+        with ProcessPoolExecutor(max_workers=MAX_PARALLEL, initializer=attach_environments,
+                                 initargs=(shared,)) as executor, store:
+            future_to_group = {executor.submit(run_job, group): group for group in tasks}
             try:
-                future.result()  # This will raise any exceptions from the worker
-            except Exception as e:
-                print(f"Error in job: {e}")
+                for future in as_completed(future_to_group):
+                    group = future_to_group[future]
+                    try:
+                        group_rows = future.result()
+                        rows.extend(group_rows)
+                        print(f"Finished {group[0][:6]} x{len(group)}: {max(row['steps'] for row in group_rows)} steps "
+                              f"in {sum(row['seconds'] for row in group_rows):.1f}s")
+                    except Exception as e:
+                        failed += len(group)
+                        print(f"Error in job: {e}")
+                    if len(rows) >= RESULTS_BATCH_SIZE:
+                        store.add_runs(rows)
+                        rows = []
+                    completed += len(group)
+                    print_eta()
+            finally:
+                # Keep what finished even if the batch is interrupted
+                store.add_runs(rows)
+    finally:
+        for environment in shared.values():
+            environment.close()
+            environment.unlink()
 
     total_time = time.time() - start_time
     h = int(total_time // 3600)
     m = int((total_time % 3600) // 60)
     s = int(total_time % 60)
     print(f"\nAll simulations complete! Total time: {h:02d}:{m:02d}:{s:02d}")
+    if failed:
+        print(f"{failed} simulations failed")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+from environment import Environment, generate_venue
+from main import find_argument_value, parse_movement_strategy, parse_engine, parse_renderer
+from simulation import run_simulation
+from visualization import GenericVisualization, JsonVisualization, VideoVisualization, StepEvents
+
+# --- Benchmark parameters ---
+BENCHMARK_SEED = 0
+OUT_DIR = "out/benchmarks"
+SHIPPED_ENVIRONMENTS = ["env0", "env1", "env2", "env3", "env4", "env5"]
+GENERATED_SIZES = [50, 100]
+# Generated maps too crowded for the Python engine, run with the NumPy engine only
+STRESS_SIZES = [200, 500]
+SPAWN_PERCENTS = [0.25, 0.5, 0.75]
+MOVEMENTS = ["static", "momentum", "random"]
+ENGINES = ["python", "numpy"]
+SPAWN_PERCENT = 0.75
+COOPERATE_PERCENT = 0.5
+UPDATE_INTERVAL = 10
+STRATEGY_INERTIA = 0.1
+FAMILIARITY = 200
+P_VALUE = 2.0
+# Timed runs of each configuration; the median is reported
+REPEATS = 5
+
+
+class StepCounter(GenericVisualization):
+    """Counts steps and person-steps; the baseline every other measurement is taken against"""
+
+    def __init__(self):
+        super().__init__()
+        self.steps = 0
+        self.live = 0
+        self.agent_updates = 0
+
+    def record_step(self, events: StepEvents):
+        if events.step > 0:
+            self.steps += 1
+            # Everyone live at the start of the step was updated
+            self.agent_updates += self.live
+        self.live += len(events.spawns) - len(events.escapes)
+
+    def export(self, verbose):
+        pass
+
+
+def load_environment(env_name: str, use_cache: bool) -> Environment:
+    """env_name is a shipped environment, or gen<size> for a generated venue"""
+    if env_name.startswith("gen"):
+        size = int(env_name[3:])
+        # Seating blocks with aisles, a few pillars and one exit per 25 cells of wall
+        return Environment(terrain=generate_venue(
+            size, size, seed=BENCHMARK_SEED, exits=max(4, 4 * size // 25), exit_width=max(2, size // 50),
+            obstacle_density=0.01, seating_blocks=(3, 3), block_size=(size // 5, size // 5),
+            aisle_width=max(2, size // 25)))
+    return Environment(env_name, use_cache=use_cache)
+
+
+def run_scenario(scenario: dict) -> dict:
+    """
+    Runs one benchmark scenario and returns its measurements. Runs in a fresh
+    worker process, so the peak memory belongs to this scenario alone.
+    """
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    movement_strategy = parse_movement_strategy(scenario["movement"])
+
+    def simulate(make_visualizers) -> tuple[float, float, StepCounter]:
+        """
+        The median and spread (max - min) of REPEATS timed runs with fresh
+        visualizers from make_visualizers(), and the last run's counter
+        """
+        timings = []
+        for _ in range(REPEATS):
+            env = load_environment(scenario["env"], use_cache=True)
+            counter = StepCounter()
+            visualizers = make_visualizers()
+            start = time.perf_counter()
+            run_simulation(movement_strategy=movement_strategy, env=env, visualizers=[counter] + visualizers,
+                           spawn_percent=scenario["spawn_percent"], cooperate_percent=COOPERATE_PERCENT,
+                           update_interval=UPDATE_INTERVAL, strategy_inertia=STRATEGY_INERTIA,
+                           familiarity=FAMILIARITY, verbose=False, p_value=P_VALUE,
+                           engine=parse_engine(scenario["engine"]), rng=np.random.default_rng(BENCHMARK_SEED))
+            timings.append(time.perf_counter() - start)
+        return float(np.median(timings)), max(timings) - min(timings), counter
+
+    # Setup without the disk cache measures parsing and the static field
+    start = time.perf_counter()
+    env = load_environment(scenario["env"], use_cache=False)
+    setup_seconds = time.perf_counter() - start
+
+    seconds, spread, counter = simulate(list)
+    result = dict(scenario)
+    result.update({
+        "width": env.width,
+        "height": env.height,
+        "people": env_people(env, scenario["spawn_percent"]),
+        "setup_seconds": setup_seconds,
+        "seconds": seconds,
+        "seconds_spread": spread,
+        "steps": counter.steps,
+        "agent_updates": counter.agent_updates,
+        "steps_per_second": counter.steps / seconds if seconds > 0 else 0.0,
+        "agent_updates_per_second": counter.agent_updates / seconds if seconds > 0 else 0.0,
+    })
+
+    if scenario["visualizers"]:
+        # Median overhead of each visualizer over the counted baseline run,
+        # clamped at 0, and the spread of the runs it was measured from
+        overhead = {}
+        overhead_spread = {}
+        with tempfile.TemporaryDirectory() as out_dir:
+            json_seconds, overhead_spread["json"], _ = simulate(lambda: [JsonVisualization(
+                filename=os.path.join(out_dir, "out.json"), environment_name=scenario["env"],
+                strategy=movement_strategy)])
+            overhead["json"] = max(0.0, json_seconds - seconds)
+            # The export of each recorded video, encoding skipped while timed
+            exports = []
+
+            def make_video() -> list[GenericVisualization]:
+                video = VideoVisualization(filename=os.path.join(out_dir, "out.mp4"), fps=10, export_frames=False,
+                                           verbose=False, renderer=parse_renderer("raster"), workers=1)
+                # Time recording and encoding separately
+                exports.append(video.export)
+                video.export = lambda verbose: None
+                return [video]
+
+            record_seconds, overhead_spread["video_record"], _ = simulate(make_video)
+            overhead["video_record"] = max(0.0, record_seconds - seconds)
+            if ffmpeg_available():
+                start = time.perf_counter()
+                exports[-1](False)
+                overhead["video_export_raster"] = time.perf_counter() - start
+        result["visualizer_overhead_seconds"] = overhead
+        result["visualizer_overhead_spread_seconds"] = overhead_spread
+
+    result["baseline_rss_mb"] = baseline_rss / 1024
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def env_people(env: Environment, spawn_percent: float) -> int:
+    """Number of people spawn_people places in env"""
+    return int(len(env.spawn_points) * spawn_percent)
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def scenarios(quick: bool) -> list[dict]:
+    """
+    The benchmark sweeps: every shipped map with every movement strategy and
+    engine, then spawn percent and generated venue size with the momentum strategy.
+    """
+    def scenario(env: str, movement: str, engine: str, spawn_percent: float, sweep: str, visualizers=False):
+        return {"sweep": sweep, "env": env, "movement": movement, "engine": engine,
+                "spawn_percent": spawn_percent, "visualizers": visualizers}
+
+    environments = SHIPPED_ENVIRONMENTS[:3] if quick else SHIPPED_ENVIRONMENTS
+    sizes = GENERATED_SIZES[:1] if quick else GENERATED_SIZES
+    # Visualizer overhead is only measured where someone spawns, otherwise it is noise
+    populated = {env: env_people(load_environment(env, use_cache=True), SPAWN_PERCENT) > 0
+                 for env in environments}
+    result = [scenario(env, movement, engine, SPAWN_PERCENT, "environment",
+                       visualizers=movement == "momentum" and populated[env])
+              for env in environments for movement in MOVEMENTS for engine in ENGINES]
+    result += [scenario(f"gen{sizes[0]}", "momentum", engine, spawn_percent, "spawn_percent")
+               for spawn_percent in SPAWN_PERCENTS for engine in ENGINES]
+    result += [scenario(f"gen{size}", "momentum", engine, SPAWN_PERCENT, "map_size", visualizers=True)
+               for size in sizes for engine in ENGINES]
+    if not quick:
+        result += [scenario(f"gen{size}", "momentum", "numpy", SPAWN_PERCENT, "map_size")
+                   for size in STRESS_SIZES]
+    return result
+
+
+def scenario_key(result: dict) -> tuple:
+    return (result["sweep"], result["env"], result["movement"], result["engine"], result["spawn_percent"])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], previous_filename: str):
+    """Prints the change in steps per second against an earlier benchmark file"""
+    with open(previous_filename) as f:
+        previous = {scenario_key(result): result for result in json.load(f)["results"]}
+    print(f"\nCompared with {previous_filename}:")
+    for result in results:
+        old = previous.get(scenario_key(result))
+        if old is None or old["steps_per_second"] == 0:
+            continue
+        ratio = result["steps_per_second"] / old["steps_per_second"]
+        print(f"  {' '.join(str(part) for part in scenario_key(result)).ljust(48)} {ratio:6.2f}x")
+
+
+def print_usage():
+    args = [
+        ["--out=filename", f"where to write the JSON results (default {OUT_DIR}/benchmark-<time>.json)"],
+        ["--quick=true", "if provided, runs a reduced set of scenarios"],
+        ["--compare=filename", "if provided, prints the speedup over an earlier results file"],
+    ]
+
+    print(f"Usage: python {sys.argv[0]} [options]")
+    print("Options:")
+    for arg, desc in args:
+        print(f"  {arg.ljust(26)} {desc}")
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print_usage()
+        return
+
+    created = datetime.now(timezone.utc)
+    out_filename = find_argument_value(
+        "out", os.path.join(OUT_DIR, f"benchmark-{created.strftime('%Y%m%d-%H%M%S')}.json"))
+    todo = scenarios(quick="--quick=true" in sys.argv)
+
+    results = []
+    # One scenario per process, one process at a time, so that timings do not
+    # compete for CPUs and every peak memory figure starts from a clean process
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for number, result in enumerate(executor.map(run_scenario, todo), start=1):
+            results.append(result)
+            print(f"[{number}/{len(todo)}] {' '.join(str(part) for part in scenario_key(result))}: "
+                  f"{result['steps']} steps, {result['steps_per_second']:.1f} steps/s, "
+                  f"{result['agent_updates_per_second']:.0f} agent updates/s, "
+                  f"setup {result['setup_seconds']:.3f}s, peak {result['peak_rss_mb']:.0f} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_filename)), exist_ok=True)
+    with open(out_filename, "w") as f:
+        json.dump({
+            "created": created.isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": BENCHMARK_SEED,
+            "results": results
+        }, f, indent=4)
+    print(f"\nSaved benchmark results to {out_filename}")
+
+    previous_filename = find_argument_value("compare", "")
+    if previous_filename:
+        compare(results, previous_filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,4 @@
-from .environment import Environment
\ No newline at end of file
+from .environment import Environment
+from .generator import generate_venue, terrain_to_text
+from .tiles import TileGrid, TILE_SIZE
+from .shared import SharedArrays
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Bump whenever the parser or Environment._init_static_field changes its output
+CACHE_VERSION = 1
+CACHE_DIR = '.cache'
+
+
+def _cache_path(filename: str, contents: bytes) -> str:
+    """Directory holding the cached arrays of one version of an environment file"""
+    digest = hashlib.sha256(contents)
+    digest.update(f'v{CACHE_VERSION}'.encode())
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(os.path.dirname(filename), CACHE_DIR, f'{name}-{digest.hexdigest()[:32]}')
+
+
+def load_cached_environment(filename: str, contents: bytes) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Returns the terrain codes and static field cached for this file contents,
+    memory-mapped read-only, or None if they have not been cached yet.
+    """
+    path = _cache_path(filename, contents)
+    try:
+        terrain = np.load(os.path.join(path, 'terrain.npy'), mmap_mode='r')
+        static_field = np.load(os.path.join(
+            path, 'static_field.npy'), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    return terrain, static_field
+
+
+def save_cached_environment(filename: str, contents: bytes, terrain: np.ndarray, static_field: np.ndarray):
+    """
+    Caches the terrain codes and static field of this file contents and removes
+    the entries of older versions of the same file. Failing to write the cache
+    is not an error, the environment is simply parsed again next time.
+    """
+    path = _cache_path(filename, contents)
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a private directory and rename it into place so that
+        # concurrent runs never see a partially written entry
+        staging = tempfile.mkdtemp(dir=cache_dir)
+    except OSError:
+        return
+    try:
+        np.save(os.path.join(staging, 'terrain.npy'), terrain)
+        np.save(os.path.join(staging, 'static_field.npy'), static_field)
+        os.replace(staging, path)
+    except OSError:
+        # Read-only location, or another run cached the same file first
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+
+    prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(prefix) and entry != os.path.basename(path) and \
+                len(entry) == len(os.path.basename(path)):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
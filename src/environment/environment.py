@@ -1,118 +1,267 @@
 from math import sqrt
 from sys import float_info
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+from .cache import load_cached_environment, save_cached_environment
+from .shared import SharedArrays
+
+WALKABLE = [' ', 'S', 'E']
+WALKABLE_CODES = [ord(cell) for cell in WALKABLE]
+# The occupancy of a cell nobody is standing on
+EMPTY = -1
+# The 8 moves a person can make, in the bit order of the neighbour tables
+DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1),
+              (1, 1), (1, -1), (-1, -1), (-1, 1)]
+# Half of the 8 moves a person can make (the graph is undirected) and their lengths
+STEPS = [(1, 0, 1.0), (0, 1, 1.0), (1, 1, sqrt(2)), (1, -1, sqrt(2))]
 
 
 class Environment:
-    def __init__(self, filename):
+    def __init__(self, filename=None, use_cache=True, text: str | None = None, terrain: np.ndarray | None = None,
+                 shared: SharedArrays | None = None):
+        """
+        Loads environment/{filename}.txt. Alternatively parses text, the contents
+        of an environment file, or takes terrain, a 2D array of cell character
+        codes such as generate_venue returns; neither touches the disk cache.
+        With shared, the arrays another Environment published with share(), the
+        terrain, static field and neighbour tables are read-only views of them.
+        """
         self.width = 0
         self.height = 0
-        self.grid: list[list[str | object]] = []  # 2D list of cell types
+        self.terrain: np.ndarray = np.zeros((0, 0), dtype=np.uint8)  # cell character codes
+        # id_num of the person standing on each cell, EMPTY if nobody is
+        self.occupancy: np.ndarray = np.zeros((0, 0), dtype=np.int32)
         self.spawn_points: list[tuple[int, int]] = []
         self.exits: list[tuple[int, int]] = []
         self.obstacles: list[tuple[int, int]] = []
-        self.static_field: list[list[float]] = []
+        self.static_field: np.ndarray = np.zeros((0, 0))
+        # Bit i set if the neighbour in DIRECTIONS[i] is walkable terrain
+        self.neighbour_mask: np.ndarray = np.zeros((0, 0), dtype=np.uint8)
+        # Flat index (y * width + x) of each of the 8 neighbours of a flat cell index, -1 if not walkable
+        self.neighbours: np.ndarray = np.zeros((0, 8), dtype=np.int32)
         self.escaped_people: list[object] = []
+        # People still in the environment by id, kept in step with the occupancy
+        self.people: dict[int, object] = {}
+
+        if shared is not None:
+            self._set_terrain(shared['terrain'])
+            self.static_field = shared['static_field']
+            self.neighbour_mask = shared['neighbour_mask']
+            self.neighbours = shared['neighbours']
+        elif terrain is not None:
+            self._set_terrain(np.asarray(terrain, dtype=np.uint8))
+            self._init_static_field()
+            self._init_neighbour_tables()
+        elif text is not None:
+            self._load(text.encode(), use_cache=False)
+        else:
+            self._load_from_file(f'environment/{filename}.txt', use_cache)
+
+    def _load_from_file(self, filename, use_cache=True):
+        """
+        Load the environment file. The parsed terrain and static field are cached
+        on disk, keyed by the file contents, so repeated runs skip both steps.
+        """
+        with open(filename, 'rb') as f:
+            contents = f.read()
+        self._load(contents, filename, use_cache)
+
+    def _load(self, contents: bytes, filename: str = '', use_cache=True):
+        """Load the contents of an environment file, through the cache kept next to filename"""
+        cached = load_cached_environment(
+            filename, contents) if use_cache else None
+        if cached is not None:
+            terrain, self.static_field = cached
+            self._set_terrain(terrain)
+            self._init_neighbour_tables()
+            return
 
-        self._load_from_file(f'environment/{filename}.txt')
+        terrain = self._parse(contents)
+        self._set_terrain(terrain)
+        self._init_static_field()
+        self._init_neighbour_tables()
+        if use_cache:
+            save_cached_environment(
+                filename, contents, terrain, self.static_field)
 
-    def _load_from_file(self, filename):
-        """Load and parse the environment file"""
-        with open(filename, 'r') as f:
-            lines = f.readlines()
+    def _parse(self, contents: bytes) -> np.ndarray:
+        """
+        Parse the environment file contents into a 2D array of cell character
+        codes. Everything after // on a line is a comment, blank lines are
+        skipped and short lines are padded with spaces.
+        """
+        data = np.frombuffer(contents, dtype=np.uint8)
+        if np.any(data >= 128):
+            raise ValueError("Environment file is not ASCII")
+        # Start and end offsets of every line, ends exclusive of the newline
+        ends = np.flatnonzero(data == ord('\n'))
+        starts = np.concatenate(([0], ends + 1))
+        ends = np.concatenate((ends, [len(data)]))
+        carriage = ends > starts
+        ends[carriage] -= data[ends[carriage] - 1] == ord('\r')
 
-        # Parse lines, handling comments
-        parsed_lines = []
-        for line in lines:
-            # Remove comments (everything after //)
-            if '//' in line:
-                line = line.split('//')[0]
-            line = line.rstrip('\n')
-            if line.strip():
-                parsed_lines.append(line)
+        # Cut every line at its first //
+        comments = np.flatnonzero((data[:-1] == ord('/')) & (data[1:] == ord('/')))
+        if len(comments):
+            lines = np.searchsorted(starts, comments, side='right') - 1
+            np.minimum.at(ends, lines, comments)
 
-        if not parsed_lines:
+        # Drop the empty lines of a leading comment block and after a trailing
+        # newline, which would stop the remaining lines being equally long
+        nonempty = np.flatnonzero(ends > starts)
+        if len(nonempty):
+            starts = starts[nonempty[0]:nonempty[-1] + 1]
+            ends = ends[nonempty[0]:nonempty[-1] + 1]
+
+        lengths = ends - starts
+        stride = int(starts[1] - starts[0]) if len(starts) > 1 else 0
+        if (lengths == lengths[0]).all() and (np.diff(starts) == stride).all():
+            # Equally long, evenly spaced lines: the usual file is a strided view
+            rows = np.lib.stride_tricks.as_strided(
+                data[starts[0]:], shape=(len(starts), lengths[0]), strides=(stride, 1))
+        else:
+            rows = np.full((len(starts), lengths.max()), ord(' '), dtype=np.uint8)
+            for row, (start, length) in enumerate(zip(starts.tolist(), lengths.tolist())):
+                rows[row, :length] = data[start:start + length]
+
+        # Skip lines with nothing but whitespace left
+        filled = (rows > ord(' ')).any(axis=1)
+        if not filled.any():
             raise ValueError(
                 "Environment file is empty or contains only comments")
+        return rows[filled, :lengths[filled].max()].copy()
+
+    def _set_terrain(self, terrain: np.ndarray):
+        """Set the terrain, an empty occupancy and the point lists from a 2D array of cell character codes"""
+        self.height, self.width = terrain.shape
+        self.terrain = terrain
+        self.occupancy = np.full(terrain.shape, EMPTY, dtype=np.int32)
+
+        for char, points in [('S', self.spawn_points), ('E', self.exits), ('#', self.obstacles)]:
+            ys, xs = np.nonzero(terrain == ord(char))
+            points.extend(zip(xs.tolist(), ys.tolist()))
+
+    def _init_static_field(self):
+        """
+        Initialize static field for pathfinding.
+        Distances are the shortest walkable paths to the nearest exit, found by a
+        single Dijkstra search seeded from every exit, so they never pass through walls.
+        """
+        terrain = self.terrain
+        walkable = np.isin(terrain, WALKABLE_CODES)
+        exits = terrain == ord('E')
+        index = np.arange(self.width * self.height).reshape(terrain.shape)
 
-        self.height = len(parsed_lines)
-        self.width = max(len(line) for line in parsed_lines)
-        self.grid = [[' ' for _ in range(self.width)]
-                     for _ in range(self.height)]
+        sources, targets, lengths = [], [], []
+        for dx, dy, length in STEPS:
+            # Cells (x, y) and (x + dx, y + dy) that are both inside the grid
+            y0, y1 = max(0, -dy), self.height - max(0, dy)
+            x0, x1 = max(0, -dx), self.width - max(0, dx)
+            connected = walkable[y0:y1, x0:x1] & \
+                walkable[y0 + dy:y1 + dy, x0 + dx:x1 + dx]
+            sources.append(index[y0:y1, x0:x1][connected])
+            targets.append(index[y0 + dy:y1 + dy, x0 + dx:x1 + dx][connected])
+            lengths.append(np.full(np.count_nonzero(connected), length))
+        graph = coo_matrix(
+            (np.concatenate(lengths), (np.concatenate(sources), np.concatenate(targets))),
+            shape=(index.size, index.size)).tocsr()
 
-        for y, line in enumerate(parsed_lines):
-            for x, char in enumerate(line):
-                self.grid[y][x] = char
+        if exits.any():
+            distance = dijkstra(graph, directed=False, indices=np.flatnonzero(exits),
+                                min_only=True).reshape(terrain.shape)
+        else:
+            distance = np.full(terrain.shape, np.inf)
 
-                if char == 'S':
-                    self.spawn_points.append((x, y))
-                elif char == 'E':
-                    self.exits.append((x, y))
-                elif char == '#':
-                    self.obstacles.append((x, y))
+        with np.errstate(divide='ignore'):
+            # Equation 1 from paper
+            self.static_field = 1 / distance
+        # Obstacles and cells with no path to an exit are not walkable
+        self.static_field[~walkable | np.isinf(distance)] = -float('inf')
+        # The static field at the exit is the maximum float value to essentially force exiting if adjacent
+        self.static_field[exits] = float_info.max
 
-        self._init_static_field()
+    def _init_neighbour_tables(self):
+        """Precompute which neighbours of every cell are walkable terrain"""
+        walkable = np.pad(np.isin(self.terrain, WALKABLE_CODES), 1)
+        index = np.pad(np.arange(self.width * self.height, dtype=np.int32).reshape(self.terrain.shape),
+                       1, constant_values=-1)
+        self.neighbour_mask = np.zeros(self.terrain.shape, dtype=np.uint8)
+        neighbours = np.empty(self.terrain.shape + (8,), dtype=np.int32)
+        for i, (dx, dy) in enumerate(DIRECTIONS):
+            shifted = (slice(1 + dy, 1 + dy + self.height),
+                       slice(1 + dx, 1 + dx + self.width))
+            self.neighbour_mask |= walkable[shifted].astype(np.uint8) << i
+            neighbours[:, :, i] = np.where(walkable[shifted], index[shifted], -1)
+        self.neighbours = neighbours.reshape(-1, 8)
 
-    def _init_static_field(self):
-        """Initialize static field for pathfinding"""
-        self.static_field = [[-float('inf') for _ in range(self.width)]
-                             for _ in range(self.height)]
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.grid[y][x] == 'E':
-                    # The static field at the exit is the maximum float value to essentially force exiting if adjacent
-                    self.static_field[y][x] = float_info.max
-                elif self.grid[y][x] == '#':
-                    # Obstacles are not walkable
-                    self.static_field[y][x] = -float('inf')
-                else:
-                    closest_exit = self.find_closest_exit(x, y)
-                    if closest_exit:
-                        exit_x, exit_y = closest_exit
-                        # Equation 1 from paper
-                        self.static_field[y][x] = 1 / sqrt(
-                            (exit_x - x) ** 2 + (exit_y - y) ** 2
-                        )
-                    else:
-                        self.static_field[y][x] = -float('inf')
+    def share(self) -> SharedArrays:
+        """
+        Publishes the terrain, static field and neighbour tables in shared
+        memory, for worker processes to load with Environment(shared=...)
+        instead of each parsing its own copy. Unlink them when the workers are done.
+        """
+        return SharedArrays({'terrain': self.terrain, 'static_field': self.static_field,
+                             'neighbour_mask': self.neighbour_mask, 'neighbours': self.neighbours})
+
+    def move_weights(self, x: int, y: int, familiarity: float) -> np.ndarray:
+        """
+        exp(familiarity * static field) for the 8 neighbours of (x, y) in
+        DIRECTIONS order, the numerators of equation 2, and 0 for neighbours that
+        are not walkable. Exits hold the maximum float, and no other cell can reach it.
+        """
+        neighbours = self.neighbours[y * self.width + x]
+        directions = np.flatnonzero(neighbours >= 0)
+        cells = neighbours[directions]
+        field = self.static_field.reshape(-1)[cells]
+        reachable = np.isfinite(field)
+        weights = np.zeros(8)
+        with np.errstate(over='ignore'):
+            weights[directions[reachable]] = np.minimum(np.exp(familiarity * field[reachable]),
+                                                        np.nextafter(float_info.max, 0))
+        weights[directions[self.terrain.reshape(-1)[cells] == ord('E')]] = float_info.max
+        return weights
+
+    def reset(self):
+        """Remove every person so the same loaded environment can be reused for another run"""
+        self.occupancy.fill(EMPTY)
+        self.people = {}
+        self.escaped_people = []
+
+    def add_person(self, person):
+        """Place a person on the grid at their position and register them as live"""
+        self.occupancy[person.y, person.x] = person.id_num
+        self.people[person.id_num] = person
+
+    def move_person(self, person, x, y):
+        """Move a live person to (x, y). Moving onto an exit makes them escape."""
+        self.occupancy[person.y, person.x] = EMPTY
+        person.x = x
+        person.y = y
+        if self.terrain[y, x] == ord('E'):
+            self.escape_person(person)
+        else:
+            self.occupancy[y, x] = person.id_num
+
+    def escape_person(self, person):
+        """Remove a person who reached an exit from the live people"""
+        del self.people[person.id_num]
+        self.escaped_people.append(person)
 
     def get_cell(self, x, y):
-        """Get the cell type at position (x, y)"""
+        """Get the person standing at position (x, y), or else its cell type"""
         if 0 <= x < self.width and 0 <= y < self.height:
-            return self.grid[y][x]
+            id_num = self.occupancy[y, x]
+            return self.people[id_num] if id_num != EMPTY else chr(self.terrain[y, x])
         else:
             return '#'
 
     def is_walkable(self, x, y):
-        cell_type = self.get_cell(x, y)
-        return cell_type in [' ', 'S', 'E']  # All these are walkable
-
-    def get_people_nearby(self, x, y):
-        people = []
-        for mod_y in [-1, 0, 1]:
-            for mod_x in [-1, 0, 1]:
-                if abs(mod_x) + abs(mod_y) != 0:
-                    new_x, new_y = x + mod_x, y + mod_y
-                    cell = self.get_cell(new_x, new_y)
-                    if hasattr(cell, 'projected_x'):
-                        people.append(cell)
-        return people
-
-    def find_closest_exit(self, x, y):
-        """
-        Find the closest exit to the given (x, y) position.
-        Uses the number of steps (taxicab geometry) as distance metric.
-        """
-        min_distance = float('inf')
-        closest_exit = None
-        for exit_x, exit_y in self.exits:
-            distance = abs(exit_x - x) + abs(exit_y - y)
-            if distance < min_distance:
-                min_distance = distance
-                closest_exit = (exit_x, exit_y)
-        return closest_exit
+        """Whether (x, y) is walkable terrain that nobody is standing on"""
+        return 0 <= x < self.width and 0 <= y < self.height and \
+            self.occupancy[y, x] == EMPTY and self.terrain[y, x] in WALKABLE_CODES
 
     def __str__(self):
-        return '\n'.join(
-            ''.join(str(cell) for cell in row)
-            for row in self.grid
-        ) + '\n'
+        """The terrain in the environment file format, with people drawn as P"""
+        cells = np.where(self.occupancy == EMPTY, self.terrain, ord('P')).astype(np.uint8)
+        return '\n'.join(bytes(row).decode('ascii') for row in cells) + '\n'
@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.ndimage import label
+
+WALL = ord('#')
+OPEN = ord(' ')
+SPAWN = ord('S')
+EXIT = ord('E')
+
+
+def generate_venue(width: int, height: int, seed: int = 0, exits: int = 4, exit_width: int = 2,
+                   obstacle_density: float = 0.0,
+                   seating_blocks: tuple[int, int] | None = None, block_size: tuple[int, int] = (10, 6),
+                   aisle_width: int = 2,
+                   spawn_regions: list[tuple[float, float, float, float]] | None = None) -> np.ndarray:
+    """
+    Generates a walled venue as a 2D array of cell character codes, the layout
+    Environment(terrain=...) takes and terrain_to_text writes out.
+
+    exits openings of exit_width cells are spread evenly around the walls.
+    seating_blocks=(columns, rows) lays out that many blocks of block_size
+    (width, height) spawn cells, centred and separated by aisles of
+    aisle_width. spawn_regions are (x0, y0, x1, y1) rectangles in fractions of
+    the venue that are also filled with spawn cells; without seating or
+    regions the middle quarter of the venue is. obstacle_density is the
+    fraction of the remaining open floor covered by single-cell pillars.
+    Cells that cannot reach an exit are walled off, so every spawn point can
+    escape. The same arguments always give the same venue.
+    """
+    if width < 3 or height < 3:
+        raise ValueError("a venue needs at least 3x3 cells")
+    if exits < 1:
+        raise ValueError("a venue needs at least one exit")
+    rng = np.random.default_rng(seed)
+    terrain = np.full((height, width), OPEN, dtype=np.uint8)
+    terrain[[0, -1], :] = WALL
+    terrain[:, [0, -1]] = WALL
+
+    if seating_blocks is not None:
+        _add_seating(terrain, seating_blocks, block_size, aisle_width)
+    if spawn_regions is None and seating_blocks is None:
+        spawn_regions = [(0.25, 0.25, 0.75, 0.75)]
+    for x0, y0, x1, y1 in spawn_regions or []:
+        region = terrain[max(1, int(y0 * height)):min(height - 1, int(y1 * height)),
+                         max(1, int(x0 * width)):min(width - 1, int(x1 * width))]
+        region[region == OPEN] = SPAWN
+
+    exit_cells = _add_exits(terrain, exits, exit_width)
+
+    if obstacle_density > 0:
+        # Keep the cells just inside each exit clear
+        clear = np.zeros(terrain.shape, dtype=bool)
+        ys, xs = exit_cells
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                clear[np.clip(ys + dy, 0, height - 1), np.clip(xs + dx, 0, width - 1)] = True
+        pillars = (terrain == OPEN) & ~clear & (
+            rng.random(terrain.shape) < obstacle_density)
+        terrain[pillars] = WALL
+
+    _wall_off_unreachable(terrain)
+    return terrain
+
+
+def _add_seating(terrain: np.ndarray, seating_blocks: tuple[int, int], block_size: tuple[int, int],
+                 aisle_width: int):
+    """Fills a centred grid of seating blocks with spawn cells"""
+    height, width = terrain.shape
+    columns, rows = seating_blocks
+    block_width, block_height = block_size
+    total_width = columns * block_width + (columns - 1) * aisle_width
+    total_height = rows * block_height + (rows - 1) * aisle_width
+    # Leave at least one aisle between the seating and the walls
+    if total_width > width - 2 - 2 * aisle_width or total_height > height - 2 - 2 * aisle_width:
+        raise ValueError(
+            f"{columns}x{rows} seating blocks of {block_width}x{block_height} do not fit in {width}x{height}")
+    left = (width - total_width) // 2
+    top = (height - total_height) // 2
+    for column in range(columns):
+        for row in range(rows):
+            x = left + column * (block_width + aisle_width)
+            y = top + row * (block_height + aisle_width)
+            terrain[y:y + block_height, x:x + block_width] = SPAWN
+
+
+def _add_exits(terrain: np.ndarray, exits: int, exit_width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Opens exits spread evenly along the walls, away from the corners.
+    Returns the (ys, xs) of the exit cells.
+    """
+    height, width = terrain.shape
+    # The wall cells in clockwise order, corners excluded
+    top = [(0, x) for x in range(1, width - 1)]
+    right = [(y, width - 1) for y in range(1, height - 1)]
+    bottom = [(height - 1, x) for x in range(width - 2, 0, -1)]
+    left = [(y, 0) for y in range(height - 2, 0, -1)]
+    perimeter = np.array(top + right + bottom + left, dtype=np.int64)
+    sides = np.repeat(np.arange(4), [len(top), len(right), len(bottom), len(left)])
+
+    side_starts = np.searchsorted(sides, np.arange(5))
+    cells = []
+    for centre in ((np.arange(exits) + 0.5) * len(perimeter) / exits).astype(np.int64):
+        # Shift each exit along its wall so it never wraps a corner
+        side_start, side_end = side_starts[sides[centre]], side_starts[sides[centre] + 1]
+        start = max(side_start, min(centre - exit_width // 2, side_end - exit_width))
+        cells.append(np.arange(start, min(side_end, start + exit_width)))
+    opening = perimeter[np.concatenate(cells)]
+    ys, xs = opening[:, 0], opening[:, 1]
+    terrain[ys, xs] = EXIT
+    return ys, xs
+
+
+def _wall_off_unreachable(terrain: np.ndarray):
+    """Turns walkable cells with no 8-connected path to an exit into walls"""
+    walkable = terrain != WALL
+    components, _ = label(walkable, structure=np.ones((3, 3), dtype=bool))
+    reachable = np.unique(components[terrain == EXIT])
+    terrain[walkable & ~np.isin(components, reachable[reachable > 0])] = WALL
+
+
+def terrain_to_text(terrain: np.ndarray) -> str:
+    """The environment file text of a 2D array of cell character codes"""
+    return '\n'.join(bytes(row).decode('ascii') for row in terrain) + '\n'
@@ -0,0 +1,62 @@
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+# Byte alignment of each array in the block
+ALIGNMENT = 64
+
+
+class SharedArrays:
+    """
+    Named arrays published once in a block of shared memory, read-only.
+    Pickling one, e.g. to pass it to a worker process, sends only the name of
+    the block and its layout; unpickling attaches to the block, so every
+    process reads the same memory through NumPy views instead of holding its
+    own copy. The process that published the arrays unlinks them once its
+    workers are done.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.layout: list[tuple[str, str, tuple[int, ...], int]] = []
+        size = 0
+        for name, array in arrays.items():
+            offset = -(-size // ALIGNMENT) * ALIGNMENT
+            self.layout.append((name, array.dtype.str, array.shape, offset))
+            size = offset + array.nbytes
+        self.memory = SharedMemory(create=True, size=max(size, 1))
+        try:
+            for (name, dtype, shape, offset), array in zip(self.layout, arrays.values()):
+                np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)[...] = array
+        except BaseException:
+            # Nobody else knows the block yet, so nobody else would free it
+            self.memory.close()
+            self.memory.unlink()
+            raise
+        self.arrays = self._views()
+
+    def _views(self) -> dict[str, np.ndarray]:
+        views = {}
+        for name, dtype, shape, offset in self.layout:
+            view = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)
+            view.flags.writeable = False
+            views[name] = view
+        return views
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __getstate__(self):
+        return self.memory.name, self.layout
+
+    def __setstate__(self, state):
+        name, self.layout = state
+        self.memory = SharedMemory(name=name)
+        self.arrays = self._views()
+
+    def close(self):
+        """Unmaps the block from this process; views of it must no longer be in use"""
+        self.arrays = {}
+        self.memory.close()
+
+    def unlink(self):
+        """Frees the block once every process has closed it; only the publisher calls this"""
+        self.memory.unlink()
@@ -0,0 +1,26 @@
+# Cells along each side of a tile
+TILE_SIZE = 32
+
+
+class TileGrid:
+    """
+    Partitions a width x height grid of cells into square tiles of tile_size
+    cells, so that work over the grid can be limited to the tiles it touches.
+    """
+
+    def __init__(self, width: int, height: int, tile_size: int = TILE_SIZE):
+        self.tile_size = tile_size
+        self.width = width
+        self.height = height
+        self.columns = -(-width // tile_size)
+        self.rows = -(-height // tile_size)
+
+    def tile(self, x, y):
+        """Flat index of the tile holding cell (x, y); works on arrays too"""
+        return (y // self.tile_size) * self.columns + x // self.tile_size
+
+    def cells(self, tile: int) -> tuple[slice, slice]:
+        """The (rows, columns) slices of a tile's cells, clipped to the grid"""
+        row, column = divmod(tile, self.columns)
+        y, x = row * self.tile_size, column * self.tile_size
+        return slice(y, min(y + self.tile_size, self.height)), slice(x, min(x + self.tile_size, self.width))
@@ -1,16 +1,10 @@
 import os
 import sys
-import json
+import numpy as np
 from matplotlib import pyplot as plt
 
-
-def find_out_dirs(root_dir) -> list[str]:
-    out_dirs: list[str] = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if filename == "out.json":
-                out_dirs.append(dirpath)
-    return out_dirs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from results import open_results  # noqa: E402
 
 
 if __name__ == "__main__":
@@ -23,6 +17,17 @@ if __name__ == "__main__":
     if not os.path.isdir(root_directory):
         print(f"Error: '{root_directory}' is not a directory.")
         sys.exit(1)
+    with open_results(root_directory) as store:
+        runs = store.select(["coop", "update_interval", "steps", "stop_reason"],
+                            movement="static", environment="env1", inertia=0.1)
+    # Runs from before runs could be cut short have no stop reason and all evacuated
+    cut_short = [run for run in runs if run["stop_reason"] not in (None, "EVACUATED")]
+    if cut_short:
+        print(f"Leaving out {len(cut_short)} runs that were cut short before evacuating")
+    runs = [run for run in runs if run["stop_reason"] in (None, "EVACUATED")]
+    coop = np.array([run["coop"] for run in runs])
+    update_interval = np.array([run["update_interval"] for run in runs])
+    steps = np.array([run["steps"] for run in runs])
 
     plt.figure()
     plt.xlabel("cooperation ratio")
@@ -34,22 +39,9 @@ if __name__ == "__main__":
     for c in c_values:
         times = []
         for rc in rc_values:
-            dir_path = os.path.join(
-                root_directory,
-                f"static/env1/coop_{rc}/update_{c}/strat_inertia_0.1"
-            )
-            out_dirs = find_out_dirs(dir_path)
-            total_time = 0
-            count = len(out_dirs)
-            for out_dir in out_dirs:
-                json_path = os.path.join(out_dir, "out.json")
-                try:
-                    with open(json_path, "r") as f:
-                        data = json.load(f)
-                    total_time += len(data.get("escape_time_history", []))
-                except (json.JSONDecodeError, IOError) as e:
-                    print(f"Warning: Could not read {json_path}: {e}")
-            avg_time = total_time / count if count > 0 else 0
+            selected = (coop == float(rc)) & (update_interval == int(c))
+            count = int(np.count_nonzero(selected))
+            avg_time = steps[selected].mean() if count > 0 else 0
             print(f"c={c}, rc={rc}, avg_time={avg_time}, count={count}")
             times.append(avg_time)
         plt.plot(rc_values, times, marker='o')
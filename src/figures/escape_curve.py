@@ -1,63 +1,43 @@
 import os
 import sys
-import json
+import numpy as np
 from matplotlib import pyplot as plt
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from results import ResultsStore, open_results, pad_series  # noqa: E402
+
 
 OVERWRITE = sys.argv.count("--overwrite") > 0
 environment = "env4"
 max_time = 0
 
 
-def find_out_dirs(root_dir) -> list[str]:
-    out_dirs: list[str] = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if filename == "out.json":
-                out_dirs.append(dirpath)
-    return out_dirs
-
-
-def sum_escape_times(root_dir):
+def sum_escape_times(store: ResultsStore, movement: str):
     """
     escape_time_history shows the number of people who have escaped at each time step.
 
-    :param root_dir: Description
+    :param store: the batch's results
+    :param movement: the movement strategy whose runs are summed
     """
-    print(f"\nProcessing directory: {root_dir}")
+    print(f"\nProcessing {movement} runs")
     global max_time
-    json_files = []
-
-    # Recursively find all JSON files
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if filename.endswith(".json"):
-                json_files.append(os.path.join(dirpath, filename))
-
-    print(f"\nFound {len(json_files)} JSON files in '{root_dir}'.")
-
-    # Sum escape times
-    escape_times = []
-    for file_path in json_files:
-        try:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            if "escape_time_history" in data:
-                arr = data["escape_time_history"]
-                escape_times.append(arr)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Warning: Could not read {file_path}: {e}")
+    runs = [row for row in store.select(["escape_time_history", "stop_reason"], movement=movement)
+            if len(row["escape_time_history"])]
+    # Runs from before runs could be cut short have no stop reason and all evacuated
+    evacuated = [row for row in runs if row["stop_reason"] in (None, "EVACUATED")]
+    if len(evacuated) < len(runs):
+        print(f"Leaving out {len(runs) - len(evacuated)} {movement} runs that were cut short")
+    escape_times = pad_series([row["escape_time_history"] for row in evacuated])
+
+    print(f"\nFound {len(escape_times)} {movement} runs.")
+    if len(escape_times) == 0:
+        return
 
     # Plot a curve of percentage of people escaped over time
-    time_steps = {}
-    max_escape_time = max([len(arr) for arr in escape_times], default=0)
-    total_count = sum(arr[-1] for arr in escape_times)
-    for t in range(max_escape_time):
-        escaped_count = sum(arr[t] if t < len(arr) else arr[-1]
-                            for arr in escape_times)
-        time_steps[t] = escaped_count / total_count
+    max_escape_time = escape_times.shape[1]
+    fraction_escaped = escape_times.sum(axis=0) / escape_times[:, -1].sum()
     max_time = max(max_time, max_escape_time + 10)
-    plt.plot(list(time_steps.keys()), list(time_steps.values()), marker='o')
+    plt.plot(np.arange(max_escape_time), fraction_escaped, marker='o')
 
 
 if __name__ == "__main__":
@@ -72,8 +52,9 @@ if __name__ == "__main__":
         sys.exit(1)
 
     plt.figure()
-    sum_escape_times(f"{root_directory}/static")
-    sum_escape_times(f"{root_directory}/momentum")
+    with open_results(root_directory) as store:
+        sum_escape_times(store, "static")
+        sum_escape_times(store, "momentum")
     plt.xlabel("Time Step")
     plt.ylabel("Fraction of People Escaped")
     plt.title(f"Evacuation Curve")
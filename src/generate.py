@@ -0,0 +1,58 @@
+import os
+import sys
+from environment import generate_venue, terrain_to_text
+from main import find_argument_value
+
+
+def parse_pair(value: str) -> tuple[int, int]:
+    """'20x10' -> (20, 10)"""
+    first, second = value.lower().split("x")
+    return int(first), int(second)
+
+
+def print_usage():
+    args = [
+        ["--name=env_name", "writes environment/env_name.txt, usable as --env=env_name"],
+        ["--size=WIDTHxHEIGHT", "the venue dimensions in cells (default 200x200)"],
+        ["--seed=number", "the seed of the obstacle layout (default 0)"],
+        ["--exits=number", "the number of exits spread around the walls (default 4)"],
+        ["--exit_width=number", "the width of each exit in cells (default 2)"],
+        ["--obstacle_density=number", "the fraction of open floor covered by pillars 0.0-1.0 (default 0.0)"],
+        ["--seating=COLUMNSxROWS", "if provided, lays out a grid of seating blocks of spawn points"],
+        ["--block=WIDTHxHEIGHT", "the size of each seating block (default 10x6)"],
+        ["--aisle=number", "the width of the aisles around seating blocks (default 2)"],
+        ["--spawn=x0,y0,x1,y1", "a spawn region in fractions of the venue; may be repeated "
+                                "(default the middle quarter when there is no seating)"],
+    ]
+
+    print(f"Usage: python {sys.argv[0]} [options]")
+    print("Options:")
+    for arg, desc in args:
+        print(f"  {arg.ljust(26)} {desc}")
+
+
+if __name__ == "__main__":
+    name = find_argument_value("name", "")
+    if "--help" in sys.argv or "-h" in sys.argv or not name:
+        print_usage()
+        sys.exit(0)
+
+    width, height = parse_pair(find_argument_value("size", "200x200"))
+    seating = find_argument_value("seating", "")
+    spawn_regions = [tuple(float(value) for value in arg.split("=", 1)[1].split(","))
+                     for arg in sys.argv if arg.startswith("--spawn=")]
+    terrain = generate_venue(
+        width, height,
+        seed=int(find_argument_value("seed", "0")),
+        exits=int(find_argument_value("exits", "4")),
+        exit_width=int(find_argument_value("exit_width", "2")),
+        obstacle_density=float(find_argument_value("obstacle_density", "0.0")),
+        seating_blocks=parse_pair(seating) if seating else None,
+        block_size=parse_pair(find_argument_value("block", "10x6")),
+        aisle_width=int(find_argument_value("aisle", "2")),
+        spawn_regions=spawn_regions or None)  # type: ignore
+
+    filename = os.path.join("environment", f"{name}.txt")
+    with open(filename, "w") as f:
+        f.write(terrain_to_text(terrain))
+    print(f"Saved {width}x{height} venue to {filename}")
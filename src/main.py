@@ -1,9 +1,10 @@
 from environment import Environment
 from person import MovementStrategy
+import os
 import sys
-from visualization import GenericVisualization, VideoVisualization, JsonVisualization
-from simulation import run_simulation
-import random
+from visualization import GenericVisualization, VideoVisualization, VideoRenderer, JsonVisualization, TrajectoryVisualization
+from simulation import run_simulation, SimulationEngine, SimulationProfiler
+import numpy as np
 
 
 def find_argument_value(arg_name: str, default: str) -> str:
@@ -13,8 +14,7 @@ def find_argument_value(arg_name: str, default: str) -> str:
     return default
 
 
-def find_movement_strategy_argument() -> MovementStrategy:
-    strategy_name = find_argument_value("movement", "momentum")
+def parse_movement_strategy(strategy_name: str) -> MovementStrategy:
     if not strategy_name:
         return MovementStrategy.STATIC_FIELD
     strategy_name = strategy_name.lower()
@@ -26,17 +26,69 @@ def find_movement_strategy_argument() -> MovementStrategy:
         return MovementStrategy.STATIC_FIELD
 
 
+def find_movement_strategy_argument() -> MovementStrategy:
+    return parse_movement_strategy(find_argument_value("movement", "momentum"))
+
+
+def parse_engine(engine_name: str) -> SimulationEngine:
+    if engine_name.lower() == "numpy":
+        return SimulationEngine.NUMPY
+    if engine_name.lower() == "strips":
+        return SimulationEngine.STRIPS
+    return SimulationEngine.PYTHON
+
+
+def find_engine_argument() -> SimulationEngine:
+    return parse_engine(find_argument_value("engine", "python"))
+
+
+def parse_renderer(renderer_name: str) -> VideoRenderer:
+    if renderer_name.lower() == "raster":
+        return VideoRenderer.RASTER
+    return VideoRenderer.MATPLOTLIB
+
+
+def find_renderer_argument() -> VideoRenderer:
+    return parse_renderer(find_argument_value("renderer", "matplotlib"))
+
+
+def replicate_filename(filename: str, replicate: int) -> str:
+    """out.json -> out_3.json, keeping a trailing .gz"""
+    compressed = filename.endswith(".gz")
+    base, extension = os.path.splitext(filename[:-3] if compressed else filename)
+    return f"{base}_{replicate}{extension}" + (".gz" if compressed else "")
+
+
 def print_usage():
     args = [
         ["--env=env_name", "the environment to use. should be a .txt file in the environment/ directory"],
         ["--movement=strategy_name",
             'the movement strategy to use. options are "static", "momentum", and "random". default is "momentum"'],
-        ["--json=filename", "if provided, exports a JSON file with the evacuation data to the given filename"],
+        ["--engine=engine_name",
+            'the simulation engine to use. options are "python", "numpy" (vectorized, for large crowds) and '
+            '"strips" (numpy split across processes, for huge venues). default is "python"'],
+        ["--workers=number",
+            "the number of worker processes, one per horizontal strip of the grid, for the strips engine "
+            "(default the number of CPUs). results are reproducible for a fixed seed and number of workers"],
+        ["--json=filename", "if provided, exports a JSON file with the evacuation data to the given filename (gzip compressed if it ends in .gz)"],
+        ["--jsonl=filename",
+            "with --json, also keeps the per-step records as JSON Lines in the given filename (gzip compressed if it ends in .gz)"],
+        ["--replicates=number",
+            "runs that many independent replicates together with the numpy engine (default 1). "
+            "requires --json and writes one file per replicate, e.g. out_0.json, out_1.json"],
+        ["--trajectory=directory",
+            "if provided, records every person's state at every step into the given directory, for replay.py"],
         ["--video=filename",
             "if provided, exports a video of the evacuation to the given filename"],
         ["--fps=number",
             "the frames per second for the exported video (default 2)"],
         ["--frames=true", "if provided, exports individual frames as PNG files in addition to the video"],
+        ["--renderer=renderer_name",
+            'how videos are drawn. options are "matplotlib" and "raster" (fast, for long runs). default is "matplotlib"'],
+        ["--cell_size=number",
+            "the even number of pixels per cell for the raster renderer (default 8)"],
+        ["--video_workers=number",
+            "the number of processes rendering the video in parallel chunks (default 1)"],
         ["--spawn_percent=number",
             "the percentage of people to spawn in the environment 0.0-1.0 (default 0.75)"],
         ["--cooperate_percent=number",
@@ -51,7 +103,14 @@ def print_usage():
             "the familiarity with the environment (default 10)"],
         ["--seed=number",
             "the random seed to use for the simulation (default is random)"],
-        ["--verbose=true", "if provided, enables verbose output during the simulation"]
+        ["--max_steps=number", "if provided, stops the simulation after that many steps"],
+        ["--stall_steps=number",
+            "stops the simulation after that many steps with no escapes and either nobody moving or nobody left able to reach an exit "
+            "(default 1000, 0 never stops)"],
+        ["--timeout=seconds", "if provided, stops the simulation after that much wall time"],
+        ["--profile=filename",
+            "if provided, exports per-phase timings and counters of the run as JSON to the given filename"],
+        ["--verbose=true", "if provided, enables verbose output during the simulation, including a profile summary"]
     ]
 
     print(f"Usage: python {sys.argv[0]} [options]")
@@ -67,15 +126,27 @@ if __name__ == "__main__":
 
     verbose = "--verbose=true" in sys.argv
     seed = find_argument_value("seed", "")
-    if seed:
-        random.seed(int(seed))
+    rng = np.random.default_rng(int(seed) if seed else None)
 
     movement_strategy = find_movement_strategy_argument()
+    engine = find_engine_argument()
     env_name = find_argument_value("env", "env1")
+    profile_filename = find_argument_value("profile", "")
+    profiler = SimulationProfiler() if verbose or profile_filename else None
+    if profiler is not None:
+        profiler.start()
     env = Environment(env_name)
+    if profiler is not None:
+        profiler.lap("setup")
 
     json_filename = find_argument_value("json", "")
     video_filename = find_argument_value("video", "")
+    jsonl_filename = find_argument_value("jsonl", "")
+    trajectory_path = find_argument_value("trajectory", "")
+    replicates = int(find_argument_value("replicates", "1"))
+    if replicates > 1 and (video_filename or trajectory_path or not json_filename):
+        print("--replicates needs --json and cannot be combined with --video or --trajectory")
+        sys.exit(1)
     visualizers: list[GenericVisualization] = []
     if video_filename:
         fps_str = find_argument_value("fps", "10")
@@ -85,13 +156,29 @@ if __name__ == "__main__":
             filename=video_filename,
             fps=fps,
             export_frames=export_frames,
-            verbose=verbose
+            verbose=verbose,
+            renderer=find_renderer_argument(),
+            cell_size=int(find_argument_value("cell_size", "8")),
+            workers=int(find_argument_value("video_workers", "1"))
         ))
-    if json_filename:
+    if trajectory_path:
+        visualizers.append(TrajectoryVisualization(
+            path=trajectory_path,
+            environment_name=env_name,
+            movement_strategy=movement_strategy))
+    if json_filename and replicates > 1:
+        visualizers.extend(JsonVisualization(
+            filename=replicate_filename(json_filename, replicate),
+            environment_name=env_name,
+            strategy=movement_strategy,
+            steps_filename=replicate_filename(jsonl_filename, replicate) if jsonl_filename else None)
+            for replicate in range(replicates))
+    elif json_filename:
         visualizers.append(JsonVisualization(
             filename=json_filename,
             environment_name=env_name,
-            strategy=movement_strategy))
+            strategy=movement_strategy,
+            steps_filename=jsonl_filename or None))
 
     spawn_percent = float(find_argument_value("spawn_percent", "0.75"))
     cooperate_percent = float(find_argument_value("cooperate_percent", "0.5"))
@@ -99,13 +186,22 @@ if __name__ == "__main__":
     strategy_inertia = float(find_argument_value("strategy_inertia", "2.0"))
     p_value = float(find_argument_value("p_value", "2.0"))
     familiarity = int(find_argument_value("familiarity", "10"))
+    max_steps = find_argument_value("max_steps", "")
+    stall_steps = int(find_argument_value("stall_steps", "1000"))
+    timeout = find_argument_value("timeout", "")
+    workers = find_argument_value("workers", "")
 
     if verbose:
-        print(f"Starting simulation with environment '{env_name}', movement strategy '{movement_strategy.name}', "
+        print(f"Starting simulation with environment '{env_name}', movement strategy '{movement_strategy.name}', engine '{engine.name}', "
               f"spawn percent {spawn_percent}, cooperate percent {cooperate_percent}, "
               f"update interval {update_interval}, strategy inertia {strategy_inertia}, p_value {p_value}, familiarity {familiarity}.")
 
     run_simulation(movement_strategy=movement_strategy, env=env,
                    visualizers=visualizers, spawn_percent=spawn_percent,
                    cooperate_percent=cooperate_percent,
-                   verbose=verbose, update_interval=update_interval, strategy_inertia=strategy_inertia, familiarity=familiarity)
+                   verbose=verbose, update_interval=update_interval, strategy_inertia=strategy_inertia, familiarity=familiarity,
+                   p_value=p_value, engine=engine, rng=rng, replicates=replicates, profiler=profiler,
+                   max_steps=int(max_steps) if max_steps else None, stall_steps=stall_steps or None,
+                   timeout=float(timeout) if timeout else None, workers=int(workers) if workers else None)
+    if profiler is not None and profile_filename:
+        profiler.export(profile_filename)
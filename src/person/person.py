@@ -1,6 +1,9 @@
 import math
 import random
+from bisect import bisect
+from itertools import accumulate
 from environment import Environment
+from environment.environment import DIRECTIONS, EMPTY
 from math import exp
 from sys import float_info
 from enum import Enum
@@ -18,26 +21,35 @@ def calculate_distance(loc_1: tuple[int, int], loc_2: tuple[int, int]) -> float:
     return math.sqrt(dx*dx + dy*dy)
 
 
-def find_open_adjacent_cells(x: int, y: int, env: Environment) -> list[tuple[int, int]]:
-    open_cells = []
-    directions = [(1, 0), (-1, 0), (0, 1), (0, -1),
-                  (1, 1), (1, -1), (-1, -1), (-1, 1)]
-    for dx, dy in directions:
-        new_x, new_y = x + dx, y + dy
-        if env.is_walkable(new_x, new_y):
-            open_cells.append((new_x, new_y))
-    return open_cells
+# For each neighbour bitmask, the (direction index, dx, dy) of its walkable neighbours
+MASK_DIRECTIONS = [[(i, dx, dy) for i, (dx, dy) in enumerate(DIRECTIONS) if mask >> i & 1]
+                   for mask in range(256)]
+
+# 3 - |move - momentum| for every move direction and the 9 possible momenta
+LOG_MOMENTUM_WEIGHTS = [[3 - calculate_distance((dx, dy), (momentum_x, momentum_y))
+                         for momentum_y in (-1, 0, 1) for momentum_x in (-1, 0, 1)]
+                        for dx, dy in DIRECTIONS]
+MOMENTUM_WEIGHTS = [[math.exp(weight) for weight in row] for row in LOG_MOMENTUM_WEIGHTS]
+# Environment.move_weights caps exp(familiarity * static field) just below the exit weight
+SATURATED_WEIGHT = math.nextafter(float_info.max, 0)
+
+
+def momentum_index(momentum: tuple[int, int]) -> int:
+    """Column of a momentum in MOMENTUM_WEIGHTS"""
+    return (momentum[1] + 1) * 3 + momentum[0] + 1
 
 
-def calculate_move_weight(projected: tuple[int, int], env: Environment, familiarity: int) -> float:
+def find_open_directions(x: int, y: int, env: Environment) -> list[tuple[int, int, int]]:
     """
-    This is the numerator in equation 2 from the paper
+    Returns the (direction index, dx, dy) of every walkable neighbour of (x, y)
+    that nobody is standing on, from the environment's neighbour bitmask.
     """
-    projected_sf = env.static_field[projected[1]][projected[0]]
-    # work around finite max float value
-    if projected_sf >= float_info.max:
-        return float_info.max
-    return exp(familiarity * projected_sf)
+    return [(i, dx, dy) for i, dx, dy in MASK_DIRECTIONS[env.neighbour_mask[y, x]]
+            if env.occupancy[y + dy, x + dx] == EMPTY]
+
+
+def find_open_adjacent_cells(x: int, y: int, env: Environment) -> list[tuple[int, int]]:
+    return [(x + dx, y + dy) for _, dx, dy in find_open_directions(x, y, env)]
 
 
 def id_to_color(id_num: int) -> list[int]:
@@ -78,51 +90,67 @@ class Person:
 
         self.history = []
 
-    def findProjectedMove(self, env):
+    def findProjectedMove(self, env, draw: float):
+        """
+        Choose the cell to try to move to this step.
+        draw is a uniform random number in [0, 1) that decides the move.
+        """
         self.game_state = PersonGameState.NOT_PLAYED
         if self.movement_strategy == MovementStrategy.RANDOM:
-            self._findProjectedMoveRandom(env)
+            self._findProjectedMoveRandom(env, draw)
         elif self.movement_strategy == MovementStrategy.STATIC_FIELD or self.movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
-            self._findProjectedMoveStaticField(env)
+            self._findProjectedMoveStaticField(env, draw)
         else:
             raise ValueError(f"Unknown movement strategy")
 
-    def _findProjectedMoveRandom(self, env):
+    def _findProjectedMoveRandom(self, env, draw: float):
         open_cells = find_open_adjacent_cells(self.x, self.y, env)
         if len(open_cells) == 0:
             self.projected_x = self.x
             self.projected_y = self.y
             return
-        move = random.choice(open_cells)
+        move = open_cells[int(draw * len(open_cells))]
         self.projected_x = move[0]
         self.projected_y = move[1]
 
-    def _findProjectedMoveStaticField(self, env):
-        open_cells = find_open_adjacent_cells(self.x, self.y, env)
-        if len(open_cells) == 0:
+    def _findProjectedMoveStaticField(self, env, draw: float):
+        open_directions = find_open_directions(self.x, self.y, env)
+        if len(open_directions) == 0:
             self.projected_x = self.x
             self.projected_y = self.y
             return
 
-        move_weights = [calculate_move_weight(
-            cell, env, self.familiarity) for cell in open_cells]
+        open_cells = [(self.x + dx, self.y + dy)
+                      for _, dx, dy in open_directions]
+        weights = env.move_weights(self.x, self.y, self.familiarity).tolist()
+        move_weights = [weights[direction] for direction, _, _ in open_directions]
+        peak = max(move_weights)
         # If at exit ignore non-exits
-        if max(move_weights) >= float_info.max:
+        if peak >= float_info.max:
             move_weights = [1.0 if weight >=
                             float_info.max else 0.0 for weight in move_weights]
+        elif peak >= SATURATED_WEIGHT:
+            move_weights = self._rescaledMoveWeights(env, open_directions)
         elif self.movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
-            for i, cell in enumerate(open_cells):
-                dx = cell[0] - self.x
-                dy = cell[1] - self.y
+            momentum = momentum_index(self.momentum)
+            for i, (direction, _, _) in enumerate(open_directions):
+                move_weights[i] = move_weights[i] * \
+                    MOMENTUM_WEIGHTS[direction][momentum]
 
-                momentum_weight = 3 - \
-                    calculate_distance((dx, dy), self.momentum)
-                move_weights[i] = move_weights[i] * exp(momentum_weight)
-
-        total_weight = sum(move_weights)
+        cumulative_weights = list(accumulate(move_weights))
         # The denominator in equation 2 from the paper
-        probabilities = [weight / total_weight for weight in move_weights]
-        move = random.choices(open_cells, weights=probabilities, k=1)[0]
+        total_weight = cumulative_weights[-1]
+        if total_weight == float('inf'):
+            # The momentum factors overflowed
+            cumulative_weights = list(accumulate(self._rescaledMoveWeights(env, open_directions)))
+            total_weight = cumulative_weights[-1]
+        if total_weight == 0.0:
+            # No open neighbour has a path to an exit
+            self.projected_x = self.x
+            self.projected_y = self.y
+            return
+        move = open_cells[bisect(cumulative_weights, draw * total_weight,
+                                 0, len(open_cells) - 1)]
         self.projected_x = move[0]
         self.projected_y = move[1]
         self.momentum = (self.projected_x - self.x,
@@ -130,6 +158,25 @@ class Person:
         if self.movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
             self.familiarity += 1
 
+    def _rescaledMoveWeights(self, env, open_directions: list[tuple[int, int, int]]) -> list[float]:
+        """
+        The weights of equation 2 computed in log space and divided by the
+        largest, for familiarities so large that exp(familiarity * static field)
+        overflows. Neighbours with no path to an exit get 0.
+        """
+        log_weights = []
+        momentum = momentum_index(self.momentum)
+        for direction, dx, dy in open_directions:
+            field = env.static_field[self.y + dy, self.x + dx]
+            log_weight = self.familiarity * field if field > -float('inf') else -float('inf')
+            if self.movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
+                log_weight += LOG_MOMENTUM_WEIGHTS[direction][momentum]
+            log_weights.append(log_weight)
+        peak = max(log_weights)
+        if peak == -float('inf'):
+            return [0.0] * len(log_weights)
+        return [exp(log_weight - peak) for log_weight in log_weights]
+
     # Function for person to choose what they will play in the prisoner's dilemma
     # True means cooperate, False means defect
     def playGame(self):
@@ -153,7 +200,11 @@ class Person:
         self.history.append(
             [num_conflicts, num_cooperators, PersonGameState.LOST])
 
-    def update_strategy(self):
+    def update_strategy(self, draw: float):
+        """
+        Record this step's game and, every update_interval steps, maybe switch strategy.
+        draw is a uniform random number in [0, 1) that decides the switch.
+        """
         if self.game_state == PersonGameState.NOT_PLAYED:
             self.history.append([0, 0, PersonGameState.NOT_PLAYED])
 
@@ -191,7 +242,7 @@ class Person:
         probability = 1 / \
             (1 + exp((current_strat_payoff - opposite_strat_payoff)/0.1))
         # Change strat based on probability
-        if random.random() <= probability:
+        if draw <= probability:
             if self.strategy == PersonStrategy.COOPERATE:
                 self.strategy = PersonStrategy.DEFECT
             elif self.strategy == PersonStrategy.DEFECT:
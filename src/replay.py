@@ -0,0 +1,63 @@
+import sys
+from person import MovementStrategy
+from main import find_argument_value, find_movement_strategy_argument, find_renderer_argument
+from visualization import GenericVisualization, VideoVisualization, JsonVisualization, TrajectoryReader
+
+
+def print_usage():
+    args = [
+        ["--trajectory=directory", "a trajectory recorded with main.py --trajectory"],
+        ["--video=filename", "if provided, renders a video of the recorded run to the given filename"],
+        ["--fps=number", "the frames per second for the rendered video (default 10)"],
+        ["--frames=true", "if provided, exports individual frames as PNG files in addition to the video"],
+        ["--renderer=renderer_name", 'options are "matplotlib" and "raster". default is "matplotlib"'],
+        ["--cell_size=number", "the even number of pixels per cell for the raster renderer (default 8)"],
+        ["--video_workers=number", "the number of processes rendering the video in parallel chunks (default 1)"],
+        ["--json=filename", "if provided, rebuilds the JSON evacuation data of the run"],
+        ["--movement=strategy_name", "overrides the movement strategy written to the JSON (default the recorded one)"],
+        ["--start=number", "the first step to replay (default 0)"],
+        ["--stop=number", "the step to stop before (default the end of the run)"],
+        ["--verbose=true", "if provided, enables verbose output"]
+    ]
+
+    print(f"Usage: python {sys.argv[0]} [options]")
+    print("Options:")
+    for arg, desc in args:
+        print(f"  {arg.ljust(26)} {desc}")
+
+
+if __name__ == "__main__":
+    if "--help" in sys.argv or "-h" in sys.argv or not find_argument_value("trajectory", ""):
+        print_usage()
+        sys.exit(0)
+
+    verbose = "--verbose=true" in sys.argv
+    reader = TrajectoryReader(find_argument_value("trajectory", ""))
+
+    visualizers: list[GenericVisualization] = []
+    video_filename = find_argument_value("video", "")
+    if video_filename:
+        visualizers.append(VideoVisualization(
+            filename=video_filename,
+            fps=int(find_argument_value("fps", "10")),
+            export_frames="--frames=true" in sys.argv,
+            verbose=verbose,
+            renderer=find_renderer_argument(),
+            cell_size=int(find_argument_value("cell_size", "8")),
+            workers=int(find_argument_value("video_workers", "1"))
+        ))
+    json_filename = find_argument_value("json", "")
+    if json_filename:
+        # Trajectories without a recorded strategy fall back to main.py's default
+        movement_strategy: MovementStrategy = reader.movement_strategy or find_movement_strategy_argument()
+        if find_argument_value("movement", ""):
+            movement_strategy = find_movement_strategy_argument()
+        visualizers.append(JsonVisualization(
+            filename=json_filename,
+            environment_name=reader.environment_name,
+            strategy=movement_strategy))
+
+    stop = find_argument_value("stop", "")
+    reader.replay(visualizers, verbose=verbose,
+                  start=int(find_argument_value("start", "0")),
+                  stop=int(stop) if stop else None)
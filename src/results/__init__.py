@@ -0,0 +1,2 @@
+from .store import ResultsStore, RESULTS_FILENAME, pad_series
+from .json_import import import_json_tree, open_results
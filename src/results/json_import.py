@@ -0,0 +1,129 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from person import PersonStrategy
+from visualization.json_visualization import open_text
+from .store import ResultsStore, RESULTS_FILENAME
+
+JSON_FILENAMES = ("out.json", "out.json.gz")
+# The directories batch.py used to write one out.json into, innermost last
+RUN_DIRECTORY = re.compile("/".join([
+    r"(?P<movement>[^/]+)",
+    r"(?P<environment>[^/]+)",
+    r"coop_(?P<coop>[^/]+)",
+    r"update_(?P<update_interval>[^/]+)",
+    r"strat_inertia_(?P<inertia>[^/]+)",
+    r"defect_punishment_(?P<p_value>[^/]+)",
+    r"iter_(?P<iteration>\d+)",
+]) + "$")
+# Parsed files written per transaction
+IMPORT_BATCH_SIZE = 256
+
+
+def find_json_files(root_dir: str) -> dict[str, tuple[int, int]]:
+    """Every out.json under root_dir, with its modification time in nanoseconds and size, in one scan"""
+    found = {}
+    for dirpath, _, filenames in os.walk(os.path.abspath(root_dir)):
+        for filename in filenames:
+            if filename in JSON_FILENAMES:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                found[path] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+def load_json_run(path: str) -> dict | None:
+    """
+    The ResultsStore row of an out.json written by the old batch.py, or None if
+    it is not inside the batch's directory layout. The parameters come from
+    the directory names and the command.txt next to it.
+    """
+    dirpath = os.path.dirname(os.path.abspath(path)).replace(os.sep, "/")
+    match = RUN_DIRECTORY.search(dirpath)
+    if match is None:
+        return None
+    row: dict = {
+        "environment": match["environment"], "movement": match["movement"], "coop": float(match["coop"]),
+        "update_interval": int(match["update_interval"]), "inertia": float(match["inertia"]),
+        "p_value": float(match["p_value"]), "iteration": int(match["iteration"]),
+        "engine": None, "spawn_percent": None, "familiarity": None, "seed": None,
+        "seconds": None, "command": None,
+    }
+    command_path = os.path.join(os.path.dirname(path), "command.txt")
+    if os.path.exists(command_path):
+        with open(command_path) as f:
+            row["command"] = f.read().strip()
+        options = dict(arg[2:].split("=", 1) for arg in row["command"].split() if arg.startswith("--") and "=" in arg)
+        # Commands from before --engine existed ran the Python engine
+        row["engine"] = options.get("engine", "python")
+        if "spawn_percent" in options:
+            row["spawn_percent"] = float(options["spawn_percent"])
+        if "familiarity" in options:
+            row["familiarity"] = int(options["familiarity"])
+        if "seed" in options:
+            row["seed"] = int(options["seed"])
+
+    with open_text(path, "r") as f:
+        data = json.load(f)
+    people_count = data["people_count"]
+    distribution = data["strategy_distribution"]
+    fractions = np.array([[step[strategy.name] for strategy in PersonStrategy] for step in distribution])
+    row.update({
+        "people_count": people_count,
+        "steps": len(data["escape_time_history"]),
+        # Files from before runs could be cut short have no stop reason
+        "stop_reason": data.get("stop_reason"),
+        "escape_time_history": np.array(data["escape_time_history"], dtype=np.int32),
+        # Everyone spawns before the first step, so the fractions are of people_count
+        "strategy_counts": np.rint(fractions * people_count).astype(np.int32).reshape(-1, len(PersonStrategy)),
+    })
+    return row
+
+
+def import_json_tree(store: ResultsStore, root_dir: str, workers: int | None = None) -> int:
+    """
+    Stores the runs of every out.json under root_dir that is new or changed
+    since the last import, parsing the files in parallel. Returns the number
+    of files parsed.
+    """
+    found = find_json_files(root_dir)
+    imported = store.imported_files()
+    changed = sorted(path for path, stat in found.items() if imported.get(path) != stat)
+    if not changed:
+        return 0
+
+    skipped = 0
+    rows: list[dict] = []
+    sources: list[tuple[str, int, int]] = []
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # A few chunks per worker keeps them busy without a round trip per file
+        chunk_size = max(1, len(changed) // (4 * workers))
+        for path, row in zip(changed, executor.map(load_json_run, changed, chunksize=chunk_size)):
+            if row is None:
+                skipped += 1
+            else:
+                rows.append(row)
+            # Files outside the layout are remembered too, so they are not parsed again
+            sources.append((path, *found[path]))
+            if len(sources) >= IMPORT_BATCH_SIZE:
+                store.add_runs(rows, sources)
+                rows, sources = [], []
+    store.add_runs(rows, sources)
+    if skipped:
+        print(f"Skipped {skipped} JSON files outside the batch directory layout")
+    return len(changed)
+
+
+def open_results(root_dir: str, workers: int | None = None) -> ResultsStore:
+    """
+    The results of the batch in root_dir: its results database, brought up to
+    date with any out.json files under root_dir.
+    """
+    store = ResultsStore(os.path.join(root_dir, RESULTS_FILENAME))
+    parsed = import_json_tree(store, root_dir, workers)
+    if parsed:
+        print(f"Imported {parsed} JSON files into {store.filename}")
+    return store
@@ -0,0 +1,157 @@
+import sqlite3
+import numpy as np
+from person import PersonStrategy
+
+# Name of the results database inside a batch's output directory
+RESULTS_FILENAME = "results.db"
+
+# Columns of the runs table; the parameters of a run come first
+PARAMETER_COLUMNS = {
+    "environment": "TEXT NOT NULL",
+    "movement": "TEXT NOT NULL",
+    # engine, spawn_percent, familiarity and seed are unknown (NULL) for
+    # imported runs without their command
+    "engine": "TEXT",
+    "spawn_percent": "REAL",
+    "coop": "REAL NOT NULL",
+    "update_interval": "INTEGER NOT NULL",
+    "inertia": "REAL NOT NULL",
+    "p_value": "REAL NOT NULL",
+    "familiarity": "INTEGER",
+    "iteration": "INTEGER NOT NULL",
+    "seed": "INTEGER",
+    # Index of the run among the replicates advanced together from seed;
+    # NULL for runs that had the seed to themselves
+    "replicate": "INTEGER",
+}
+RESULT_COLUMNS = {
+    "people_count": "INTEGER NOT NULL",
+    "steps": "INTEGER NOT NULL",
+    # A StopReason name; runs that did not evacuate end early
+    "stop_reason": "TEXT",
+    "seconds": "REAL",
+    "command": "TEXT",
+    # int32 series: escaped so far per step, and per step the number of
+    # people with each strategy in PersonStrategy order
+    "escape_time_history": "BLOB NOT NULL",
+    "strategy_counts": "BLOB NOT NULL",
+}
+COLUMNS = {**PARAMETER_COLUMNS, **RESULT_COLUMNS}
+# One run per scenario iteration; rerunning an iteration replaces it
+KEY_COLUMNS = ["environment", "movement", "coop", "update_interval", "inertia", "p_value", "iteration"]
+INDEXED_COLUMNS = ["movement", "coop", "update_interval", "inertia", "p_value", "seed", "stop_reason"]
+SERIES_DTYPE = np.dtype("<i4")
+
+
+def _encode(column: str, value):
+    if column in ("escape_time_history", "strategy_counts"):
+        return np.asarray(value, dtype=SERIES_DTYPE).tobytes()
+    if column == "seed" and value is not None and value >= 2 ** 63:
+        # SQLite integers are signed 64 bit; batch seeds are unsigned
+        return value - 2 ** 64
+    return value
+
+
+def _decode(column: str, value):
+    if column == "escape_time_history":
+        return np.frombuffer(value, dtype=SERIES_DTYPE)
+    if column == "strategy_counts":
+        return np.frombuffer(value, dtype=SERIES_DTYPE).reshape(-1, len(PersonStrategy))
+    if column == "seed" and value is not None and value < 0:
+        return value + 2 ** 64
+    return value
+
+
+def pad_series(series: list[np.ndarray]) -> np.ndarray:
+    """
+    Stacks 1D series of different lengths into a (runs, longest) array, each
+    padded with its last value, as a finished run's counts stay put.
+    """
+    lengths = np.array([len(values) for values in series], dtype=np.int64)
+    padded = np.zeros((len(series), lengths.max(initial=0)), dtype=np.result_type(*series, np.int32))
+    if padded.size == 0:
+        return padded
+    columns = np.arange(padded.shape[1])
+    filled = columns < lengths[:, None]
+    padded[filled] = np.concatenate(series)
+    # Index of the last real value to the left of every column
+    last = np.minimum(columns, np.maximum(lengths - 1, 0)[:, None])
+    return np.take_along_axis(padded, last, axis=1)
+
+
+class ResultsStore:
+    """
+    The results of a batch in one SQLite database: a row per run with its
+    parameters in indexed columns and its time series as compact blobs.
+    Only one process should write at a time; any number may read.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=60)
+        # Readers such as the figure scripts do not block the batch writing
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, "
+                f"{', '.join(f'{name} {kind}' for name, kind in COLUMNS.items())})")
+            # Databases from before a column existed get it added, empty
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(runs)")}
+            for name, kind in COLUMNS.items():
+                if name not in existing:
+                    self.connection.execute(f"ALTER TABLE runs ADD COLUMN {name} {kind}")
+            self.connection.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS runs_key ON runs ({', '.join(KEY_COLUMNS)})")
+            # The out.json files imported so far, see json_import
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS imported_files "
+                "(path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)")
+            for column in INDEXED_COLUMNS:
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS runs_{column} ON runs ({column})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add_runs(self, runs: list[dict], imported_files: list[tuple[str, int, int]] = []):
+        """
+        Stores runs, dicts with every column, in a single transaction, together
+        with the (path, mtime_ns, size) of the files they were imported from.
+        """
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [[_encode(column, run.get(column)) for column in COLUMNS] for run in runs])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO imported_files (path, mtime_ns, size) VALUES (?, ?, ?)", imported_files)
+
+    def imported_files(self) -> dict[str, tuple[int, int]]:
+        """The (mtime_ns, size) of every imported file by path"""
+        return {path: (mtime_ns, size) for path, mtime_ns, size in
+                self.connection.execute("SELECT path, mtime_ns, size FROM imported_files")}
+
+    def keys(self) -> set[tuple]:
+        """The KEY_COLUMNS values of every stored run"""
+        return set(self.connection.execute(f"SELECT {', '.join(KEY_COLUMNS)} FROM runs"))
+
+    def select(self, columns: list[str], **filters) -> list[dict]:
+        """
+        The given columns of every run whose columns equal the filters, in the
+        order they were stored, e.g. select(["steps"], environment="env1", coop=0.5).
+        Series come back as NumPy arrays.
+        """
+        unknown = [column for column in list(columns) + list(filters) if column not in COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown result columns: {unknown}")
+        where = " AND ".join(f"{column} = ?" for column in filters)
+        rows = self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM runs{' WHERE ' + where if where else ''} ORDER BY id",
+            [_encode(column, value) for column, value in filters.items()])
+        return [{column: _decode(column, value) for column, value in zip(columns, row)} for row in rows]
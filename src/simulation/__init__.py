@@ -1 +1,2 @@
-from .simulation import run_simulation
+from .simulation import run_simulation, SimulationEngine
+from .profiler import SimulationProfiler
@@ -0,0 +1,130 @@
+import json
+from time import perf_counter
+import numpy as np
+
+
+class NullProfiler:
+    """
+    The profiler used when none is passed to run_simulation. Every hook is a
+    no-op, so an uninstrumented run pays only a few empty calls per step.
+    """
+
+    def start(self):
+        pass
+
+    def start_step(self):
+        pass
+
+    def lap(self, phase: str):
+        pass
+
+    def end_step(self):
+        pass
+
+    def count(self, moved: int, escapes: int, flips: int, conflict_sizes):
+        pass
+
+
+class SimulationProfiler(NullProfiler):
+    """
+    Collects the wall time of each phase of the game loop, per-step counters
+    and per-step latencies. Pass one to run_simulation, then print summary()
+    or export() it to JSON.
+    """
+
+    def __init__(self):
+        # Seconds spent in each phase, in the order phases first ran
+        self.phase_seconds: dict[str, float] = {}
+        self.step_seconds: list[float] = []
+        self.moved = 0
+        self.escapes = 0
+        self.flips = 0
+        self.conflicts = 0
+        # conflict_size_counts[n] is the number of conflicts between n people
+        self.conflict_size_counts = np.zeros(0, dtype=np.int64)
+        self._started = False
+        self._last = 0.0
+        self._step_start = 0.0
+
+    def start(self):
+        """
+        Starts the clock. Later calls keep the first start, so setup timed
+        before run_simulation, such as loading the environment, is counted.
+        """
+        if not self._started:
+            self._started = True
+            self._last = perf_counter()
+
+    def start_step(self):
+        # Time since the last lap is charged to the step's first phase, so the
+        # phase totals add up to the wall time since start()
+        self._step_start = perf_counter()
+
+    def lap(self, phase: str):
+        """Charges the time since the previous lap to phase"""
+        now = perf_counter()
+        self.phase_seconds[phase] = self.phase_seconds.get(
+            phase, 0.0) + now - self._last
+        self._last = now
+
+    def end_step(self):
+        self.step_seconds.append(self._last - self._step_start)
+
+    def count(self, moved: int, escapes: int, flips: int, conflict_sizes):
+        """Adds one step's counters; conflict_sizes holds the number of people in each conflict"""
+        self.moved += int(moved)
+        self.escapes += int(escapes)
+        self.flips += int(flips)
+        self.conflicts += len(conflict_sizes)
+        if len(conflict_sizes):
+            counts = np.bincount(np.asarray(conflict_sizes, dtype=np.int64))
+            if len(counts) > len(self.conflict_size_counts):
+                self.conflict_size_counts = np.pad(
+                    self.conflict_size_counts, (0, len(counts) - len(self.conflict_size_counts)))
+            self.conflict_size_counts[:len(counts)] += counts
+
+    def to_dict(self) -> dict:
+        step_seconds = np.array(self.step_seconds)
+        latency = {}
+        if len(step_seconds):
+            latency = {
+                "mean": float(step_seconds.mean()),
+                "p50": float(np.percentile(step_seconds, 50)),
+                "p90": float(np.percentile(step_seconds, 90)),
+                "p99": float(np.percentile(step_seconds, 99)),
+                "max": float(step_seconds.max()),
+            }
+        return {
+            "steps": len(self.step_seconds),
+            "total_seconds": sum(self.phase_seconds.values()),
+            "phase_seconds": self.phase_seconds,
+            "step_latency_seconds": latency,
+            "moved": self.moved,
+            "escapes": self.escapes,
+            "strategy_flips": self.flips,
+            "conflicts": self.conflicts,
+            "conflict_sizes": {str(size): int(count) for size, count in
+                               enumerate(self.conflict_size_counts.tolist()) if count},
+        }
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        total = data["total_seconds"] or 1.0
+        lines = [f"Profile of {data['steps']} steps in {data['total_seconds']:.3f}s:"]
+        for phase, seconds in self.phase_seconds.items():
+            lines.append(
+                f"\t{phase.ljust(20)} {seconds:9.4f}s {100 * seconds / total:5.1f}%")
+        latency = data["step_latency_seconds"]
+        if latency:
+            lines.append("\tstep latency         " + ", ".join(
+                f"{name} {1000 * value:.3f}ms" for name, value in latency.items()))
+        lines.append(f"\tmoved {data['moved']}, escapes {data['escapes']}, "
+                     f"strategy flips {data['strategy_flips']}, conflicts {data['conflicts']}")
+        if data["conflict_sizes"]:
+            lines.append("\tconflict sizes       " + ", ".join(
+                f"{size}: {count}" for size, count in data["conflict_sizes"].items()))
+        return "\n".join(lines)
+
+    def export(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
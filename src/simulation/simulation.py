@@ -1,63 +1,76 @@
-import copy
-import random
+import os
+import numpy as np
+from enum import Enum
 from environment import Environment
 from person import Person, MovementStrategy, PersonStrategy, PersonGameState
-from visualization import GenericVisualization, StepData
+from visualization import GenericVisualization, CountingVisualization, StepEvents, StopReason
+from .vectorized import vectorized_game_loop, replicate_game_loop
+from .strips import strip_game_loop
+from .profiler import NullProfiler, SimulationProfiler
+from .stopping import StopConditions, exit_distances
 
-def prisoners_dilemma(person_list: list[Person], location: tuple[int, int], verbose=False):
+
+class SimulationEngine(Enum):
+    PYTHON = 1
+    NUMPY = 2
+    # The NumPy engine with the grid split into strips across worker processes
+    STRIPS = 3
+
+
+def prisoners_dilemma(person_list: list[Person], location: tuple[int, int], draws: tuple[float, float], verbose=False) -> Person | None:
     """
     Function to play the prisoner's dilemma game when there is a conflict
     among multiple people trying to move to the same cell.
+    draws are two uniform random numbers in [0, 1): the first decides whether
+    competing defectors produce a winner, the second picks the winner.
+    Returns the winner, or None if nobody won.
     """
 
     if len(person_list) < 2:
         raise ValueError(
             "prisoner dilemma was called with less than 2 people")
 
-    actions: list[bool] = []
+    # Split the players by the action they play in a single pass
     collaborator_list: list[Person] = []
     defector_list: list[Person] = []
     for person in person_list:
-        actions.append(person.playGame())
-    for index, person in enumerate(person_list):
-        if actions[index]:
-            collaborator_list.append(person)
-        else:
-            defector_list.append(person)
+        (collaborator_list if person.playGame() else defector_list).append(person)
+    num_conflicts = len(person_list)
+    num_cooperators = len(collaborator_list)
+
     winner = None
     if len(defector_list) == 0:
         # All collaborate! Choose a random collaborator to win
-        winner = random.choice(collaborator_list)
-        winner.win(num_conflicts=len(person_list),
-                   num_cooperators=len(collaborator_list))
+        winner = collaborator_list[int(draws[1] * len(collaborator_list))]
     elif len(defector_list) == 1:
         # Lone defector wins
         winner = defector_list[0]
-        defector_list[0].win(num_conflicts=len(person_list),
-                             num_cooperators=len(collaborator_list))
-    else:
+    elif draws[0] < 1/len(defector_list) ** (defector_list[0].p_value - 1):
         # competition between all defectors
-        if random.random() < 1/len(defector_list) ** (defector_list[0].p_value - 1):
-            winner = random.choice(defector_list)
-            winner.win(num_conflicts=len(person_list),
-                       num_cooperators=len(collaborator_list))
-    [person.lose(len(person_list), len(collaborator_list))
-     for person in collaborator_list if person != winner]
-    [person.lose(len(person_list), len(collaborator_list))
-     for person in defector_list if person != winner]
+        winner = defector_list[int(draws[1] * len(defector_list))]
+
+    for person in person_list:
+        if person is winner:
+            person.win(num_conflicts=num_conflicts,
+                       num_cooperators=num_cooperators)
+        else:
+            person.lose(num_conflicts, num_cooperators)
     if verbose:
         print(
             f"Prisoner's Dilemma at {location}:\n\tcooperate: {[str(c) for c in collaborator_list]}\n\tdefect: {[str(d) for d in defector_list]}\n\tWinner: {winner}")
+    return winner
 
 
 def spawn_people(env, cooperate_percent: float,
                  update_interval: int, strategy_inertia: float,
-                 movement_strategy: MovementStrategy, spawn_percent: float, familiarity: int):
+                 movement_strategy: MovementStrategy, spawn_percent: float, familiarity: int,
+                 rng: np.random.Generator, p_value: float = 2):
     """
     Function to spawn people in the environment at random spawn points.
     """
     spawn_count = int(len(env.spawn_points) * spawn_percent)
-    spawn_points = random.sample(env.spawn_points, spawn_count)
+    spawn_points = [env.spawn_points[i] for i in
+                    rng.permutation(len(env.spawn_points))[:spawn_count].tolist()]
 
     # Calculate exact number of cooperators and defectors
     cooperate_count = int(spawn_count * cooperate_percent)
@@ -68,121 +81,214 @@ def spawn_people(env, cooperate_percent: float,
                   [PersonStrategy.DEFECT] * defect_count)
 
     # Shuffle the strategies
-    random.shuffle(strategies)
+    strategies = [strategies[i] for i in rng.permutation(spawn_count).tolist()]
 
     # Assign strategies to spawn points
     for count, ((x, y), strategy) in enumerate(zip(spawn_points, strategies), start=1):
-        env.grid[y][x] = Person(x=x, y=y, id_num=count,
-                                movement_strategy=movement_strategy,
-                                strategy=strategy,
-                                strategy_inertia=strategy_inertia,
-                                update_interval=update_interval,
-                                familiarity=familiarity)
+        env.add_person(Person(x=x, y=y, id_num=count,
+                              movement_strategy=movement_strategy,
+                              strategy=strategy,
+                              strategy_inertia=strategy_inertia,
+                              update_interval=update_interval,
+                              familiarity=familiarity,
+                              p_value=p_value))
 
 
-def move(env):
+def move(env) -> tuple[list[tuple[int, int, int, int, int]], list[int]]:
     """
     Function to move each person in the environment to their projected position.
+    The grid is updated in place. People only project onto cells that were empty
+    and conflicts leave at most one winner per cell, so no move can overwrite or
+    clear another person and the order of the moves does not matter.
+    Returns the moves as (id, from x, from y, to x, to y) and the ids of the
+    people who escaped.
     """
 
-    env_copy = copy.deepcopy(env)
-    # Loop through each item in the environment and look for people
-    for row in range(len(env.grid)):
-        for col in range(len(env.grid[row])):
-            current_value = env.grid[row][col]
-            if isinstance(current_value, Person):
-                current_person = current_value
-                # Remove the current person from their current position
-                env_copy.grid[row][col] = " "
-                # Change the current person's x and y values to where they wanted to move
-                current_person.x = current_person.projected_x
-                current_person.y = current_person.projected_y
-                # If they are not moving to an exit, move them in the environment
-                if not (env.grid[current_person.y][current_person.x] == "E"):
-                    env_copy.grid[current_person.y][current_person.x] = current_person
-                else:
-                    env_copy.escaped_people.append(current_person)
-    return env_copy
-
-
-def update_strategy(env):
-    for row in range(len(env.grid)):
-        for col in range(len(env.grid[row])):
-            current_value = env.grid[row][col]
-            if isinstance(current_value, Person):
-                current_person = current_value
-                current_person.update_strategy()
-
-
-def identify_move_conflicts(env, x, y):
+    moves: list[tuple[int, int, int, int, int]] = []
+    escapes: list[int] = []
+    # Copy the live people since escaping removes them from the registry
+    for current_person in list(env.people.values()):
+        x, y = current_person.x, current_person.y
+        if current_person.projected_x == x and current_person.projected_y == y:
+            continue
+        # Change the current person's position to where they wanted to move,
+        # escaping if it is an exit
+        env.move_person(current_person, current_person.projected_x,
+                        current_person.projected_y)
+        moves.append((current_person.id_num, x, y,
+                      current_person.x, current_person.y))
+        if current_person.id_num not in env.people:
+            escapes.append(current_person.id_num)
+    return moves, escapes
+
+
+def update_strategy(env, rng: np.random.Generator) -> list[tuple[int, PersonStrategy]]:
+    """Updates everyone's strategy and returns the (id, new strategy) of those who switched"""
+    # One uniform per person, drawn in bulk
+    draws = rng.random(len(env.people)).tolist()
+    flips: list[tuple[int, PersonStrategy]] = []
+    for current_person, draw in zip(env.people.values(), draws):
+        strategy = current_person.strategy
+        current_person.update_strategy(draw)
+        if current_person.strategy != strategy:
+            flips.append((current_person.id_num, current_person.strategy))
+    return flips
+
+
+def find_move_conflicts(people) -> dict[tuple[int, int], list[Person]]:
+    """
+    Function to identify the cells multiple people are trying to move to.
+    People are bucketed by projected cell in one pass. Returns each contested
+    (x, y) with the people trying to move there, both in row-major order, which
+    is the order a scan over the grid finds them in.
     """
-    Function to identify if multiple people are trying to move to the same cell.
-    Returns a list of people trying to move to the cell at (x, y)."""
 
-    if not env.is_walkable(x, y):
-        return []
-    conflict_people = []
-    people_nearby = env.get_people_nearby(x, y)
-    for person in people_nearby:
-        if person.projected_x == x and person.projected_y == y:
-            conflict_people.append(person)
-    return conflict_people
+    targets: dict[tuple[int, int], list[Person]] = {}
+    for person in people:
+        # People staying put never conflict, their own cell is occupied
+        if person.projected_x != person.x or person.projected_y != person.y:
+            targets.setdefault(
+                (person.projected_y, person.projected_x), []).append(person)
+    return {(x, y): sorted(targets[(y, x)], key=lambda p: (p.y, p.x))
+            for y, x in sorted(target for target, bucket in targets.items() if len(bucket) > 1)}
 
 
-def game_loop(env: Environment, visualizers: list[GenericVisualization], verbose: bool):
+def game_loop(env: Environment, visualizers: list[GenericVisualization], rng: np.random.Generator, verbose: bool,
+              profiler: NullProfiler | None = None, stop: StopConditions | None = None):
     """
-    Function to loop through the grid moving people while there are still those who haven't reached the exit
+    Function to loop through the grid moving people while there are still those who haven't reached the exit,
+    or until stop ends the run early
     """
+    if profiler is None:
+        profiler = NullProfiler()
+    if stop is None:
+        stop = StopConditions()
+    distances = exit_distances(env).tolist()
     iteration = 0
-    while any(isinstance(item, Person) for row in env.grid for item in row):
+    flips: list[tuple[int, PersonStrategy]] = []
+    reason = StopReason.EVACUATED
+    profiler.lap("setup")
+    while env.people:
+        profiler.start_step()
         if verbose:
             print(f"Iteration {iteration}:")
         # Find projected moves for each player
-        for row in env.grid:
-            for item in row:
-                if isinstance(item, Person):
-                    item.findProjectedMove(env)
+        draws = rng.random(len(env.people)).tolist()
+        for person, draw in zip(env.people.values(), draws):
+            person.findProjectedMove(env, draw)
+        profiler.lap("projected_moves")
         # Play the prisoner's dilemma if any two people have the same projected moves
-        for y in range(len(env.grid)):
-            for x in range(len(env.grid[y])):
-                conflict_people = identify_move_conflicts(env, x, y)
-                if len(conflict_people) > 1:
-                    prisoners_dilemma(
-                        conflict_people, location=(x, y), verbose=verbose)
+        conflicts = find_move_conflicts(env.people.values())
+        profiler.lap("conflict_detection")
+        draws = rng.random((len(conflicts), 2)).tolist()
+        outcomes: list[tuple[int, bool]] = []
+        for (location, conflict_people), conflict_draws in zip(conflicts.items(), draws):
+            winner = prisoners_dilemma(
+                conflict_people, location=location, draws=conflict_draws, verbose=verbose)
+            outcomes += [(person.id_num, person is winner)
+                         for person in conflict_people]
+        profiler.lap("prisoners_dilemma")
         # Move each player
-        env = move(env)
-        [visualizer.record_step(
-            StepData(
-                grid_state=env.grid,
-                escaped_people=env.escaped_people
-            )) for visualizer in visualizers]
+        moves, escapes = move(env)
+        profiler.lap("move")
+        events = StepEvents(iteration + 1, strategy_flips=flips, moves=moves,
+                            escapes=escapes, conflicts=outcomes)
+        [visualizer.record_step(events) for visualizer in visualizers]
+        profiler.lap("record_step")
         if verbose:
             print(f"Updating strategies...")
-        update_strategy(env)
+        flips = update_strategy(env, rng)
+        profiler.lap("update_strategy")
+        profiler.count(len(moves), len(escapes), len(flips),
+                       [len(conflict_people) for conflict_people in conflicts.values()])
+        profiler.end_step()
         iteration += 1
         if verbose:
             print()
+        if env.people:
+            stalled = False
+            if stop.stall_steps is not None:
+                # Whether anyone left can reach an exit only matters on a step with moves and no escapes
+                reachable = bool(moves) and not escapes and any(
+                    distances[person.y][person.x] > 0 for person in env.people.values())
+                stalled = stop.stalled(np.array([len(escapes)]), np.array([len(moves)]),
+                                       np.array([1.0 if reachable else 0.0]))[0]
+            cut_short = StopReason.STALLED if stalled else stop.out_of_budget(iteration)
+            profiler.lap("stop_check")
+            if cut_short is not None:
+                reason = cut_short
+                break
     if verbose:
-        print(f"All people have evacuated in {iteration} iterations.")
+        if reason == StopReason.EVACUATED:
+            print(f"All people have evacuated in {iteration} iterations.")
+        else:
+            print(f"Stopped after {iteration} iterations ({reason.name}) with {len(env.people)} people left.")
         people: list[Person] = env.escaped_people  # type: ignore
         print(
             f"Escaped people: {[p.id_num for p in people]}")
 
+    [visualizer.record_stop(reason) for visualizer in visualizers]
     [visualizer.export(verbose) for visualizer in visualizers]
+    profiler.lap("export")
 
 
-def run_simulation(movement_strategy: MovementStrategy, env: Environment, visualizers: list[GenericVisualization], spawn_percent: float, cooperate_percent: float, update_interval: int, strategy_inertia: float, familiarity: int, verbose=True):
+def run_simulation(movement_strategy: MovementStrategy, env: Environment, visualizers: list[GenericVisualization], spawn_percent: float, cooperate_percent: float, update_interval: int, strategy_inertia: float, familiarity: int, verbose=True, p_value: float = 2, engine: SimulationEngine = SimulationEngine.PYTHON,
+                   rng: np.random.Generator | None = None, replicates: int = 1, profiler: NullProfiler | None = None,
+                   max_steps: int | None = None, stall_steps: int | None = None, timeout: float | None = None,
+                   workers: int | None = None):
     """
     Primary entry point to run the evacuation simulation.
     Outputs data via the provided visualizers.
+    All randomness comes from rng, so each simulation owns an independent,
+    reproducible stream. A freshly seeded generator is used if none is given.
+    With replicates > 1, that many independent runs of the scenario are advanced
+    together as one array computation (the engine is always NumPy), and
+    visualizers must hold one JsonVisualization or ResultsVisualization per
+    replicate.
+    A SimulationProfiler passed as profiler collects phase timings and
+    counters, and its summary is printed when verbose.
+    max_steps, stall_steps and timeout (in seconds) cut runs short, see
+    StopConditions; visualizers are told why each run stopped.
+    The STRIPS engine runs one worker process per horizontal strip of the
+    grid, workers of them (default the number of CPUs); its results are
+    reproducible for a fixed seed and number of workers.
     """
 
-    spawn_people(env, movement_strategy=movement_strategy,
-                 spawn_percent=spawn_percent, cooperate_percent=cooperate_percent, strategy_inertia=strategy_inertia, update_interval=update_interval, familiarity=familiarity)
-    [visualizer.record_step(
-        StepData(
-            grid_state=env.grid,
-            escaped_people=env.escaped_people
-        )) for visualizer in visualizers]
-    game_loop(env=env, visualizers=visualizers,
-              verbose=verbose)
+    if rng is None:
+        rng = np.random.default_rng()
+    if profiler is None:
+        profiler = NullProfiler()
+    profiler.start()
+    stop = StopConditions(max_steps=max_steps, stall_steps=stall_steps, timeout=timeout, replicates=replicates)
+    profiler.lap("setup")
+    if replicates > 1:
+        if len(visualizers) != replicates or not all(isinstance(v, CountingVisualization) for v in visualizers):
+            raise ValueError(
+                "replicated runs need exactly one JsonVisualization or ResultsVisualization per replicate")
+        replicate_game_loop(env=env, visualizers=visualizers,  # type: ignore
+                            movement_strategy=movement_strategy, cooperate_percent=cooperate_percent,
+                            update_interval=update_interval, strategy_inertia=strategy_inertia,
+                            spawn_percent=spawn_percent, familiarity=familiarity, p_value=p_value,
+                            rng=rng, verbose=verbose, profiler=profiler, stop=stop)
+    else:
+        spawn_people(env, movement_strategy=movement_strategy,
+                     spawn_percent=spawn_percent, cooperate_percent=cooperate_percent, strategy_inertia=strategy_inertia, update_interval=update_interval, familiarity=familiarity, rng=rng, p_value=p_value)
+        profiler.lap("spawn")
+        events = StepEvents(0, spawns=[(person.id_num, person.x, person.y, person.strategy)
+                                       for person in env.people.values()])
+        for visualizer in visualizers:
+            visualizer.start(env)
+            visualizer.record_step(events)
+        profiler.lap("record_step")
+        if engine == SimulationEngine.NUMPY:
+            vectorized_game_loop(env=env, visualizers=visualizers,
+                                 movement_strategy=movement_strategy, rng=rng, verbose=verbose, profiler=profiler,
+                                 stop=stop)
+        elif engine == SimulationEngine.STRIPS:
+            strip_game_loop(env=env, visualizers=visualizers, movement_strategy=movement_strategy, rng=rng,
+                            verbose=verbose, workers=workers or os.cpu_count() or 1, profiler=profiler, stop=stop)
+        else:
+            game_loop(env=env, visualizers=visualizers,
+                      rng=rng, verbose=verbose, profiler=profiler, stop=stop)
+    if verbose and isinstance(profiler, SimulationProfiler):
+        print(profiler.summary())
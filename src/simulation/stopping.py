@@ -0,0 +1,51 @@
+from time import perf_counter
+import numpy as np
+from environment import Environment
+from visualization import StopReason
+
+
+def exit_distances(env: Environment) -> np.ndarray:
+    """
+    The walking distance from every cell to the nearest exit, 0 on cells
+    with no path to one, as people there cannot make progress anyway.
+    """
+    with np.errstate(divide='ignore'):
+        return np.where(env.static_field > 0, 1 / np.maximum(env.static_field, 0), 0.0)
+
+
+class StopConditions:
+    """
+    Ends runs that would otherwise never finish: after max_steps steps, once
+    timeout seconds of wall time have passed, or once stall_steps steps in a
+    row brought no escape and either nobody moving or nobody left with a path
+    to an exit. A crowd that keeps moving, even at random, never stalls.
+    Each condition is off when None. Stalls are tracked per replicate.
+    """
+
+    def __init__(self, max_steps: int | None = None, stall_steps: int | None = None,
+                 timeout: float | None = None, replicates: int = 1):
+        self.max_steps = max_steps
+        self.stall_steps = stall_steps
+        self.deadline = None if timeout is None else perf_counter() + timeout
+        self.steps_without_progress = np.zeros(replicates, dtype=np.int64)
+
+    def stalled(self, escapes: np.ndarray, moved: np.ndarray, distance: np.ndarray) -> np.ndarray:
+        """
+        Records a step from the escapes, the number of people who moved and the
+        total distance to the exits of the people left in each replicate, or
+        any positive value when one of them has a path to an exit; it is 0 when
+        none of them has. Returns a mask of the replicates that have stalled.
+        """
+        progress = (escapes > 0) | ((moved > 0) & (distance > 0))
+        self.steps_without_progress = np.where(progress, 0, self.steps_without_progress + 1)
+        if self.stall_steps is None:
+            return np.zeros(len(progress), dtype=bool)
+        return self.steps_without_progress >= self.stall_steps
+
+    def out_of_budget(self, steps: int) -> StopReason | None:
+        """Whether every replicate must stop after this many steps"""
+        if self.max_steps is not None and steps >= self.max_steps:
+            return StopReason.MAX_STEPS
+        if self.deadline is not None and perf_counter() >= self.deadline:
+            return StopReason.TIMEOUT
+        return None
@@ -0,0 +1,417 @@
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import numpy as np
+from environment import Environment, SharedArrays
+from environment.environment import EMPTY
+from person import Person, MovementStrategy, PersonStrategy, PersonGameState
+from visualization import GenericVisualization, StepEvents, StopReason
+from .profiler import NullProfiler
+from .stopping import StopConditions, exit_distances
+from .vectorized import (AgentArrays, EnvironmentArrays, DIRECTIONS, STRATEGIES,
+                         find_projected_moves, play_conflicts, end_step)
+
+
+def strip_bounds(height: int, strips: int) -> np.ndarray:
+    """The first row of each of strips horizontal strips of about equal height, followed by height"""
+    return np.linspace(0, height, strips + 1).round().astype(np.int64)
+
+
+class StripReport:
+    """What one strip sends its parent after a step; the per-person lists are None unless recording"""
+
+    def __init__(self, escaped: AgentArrays, moved: int, flipped: int, conflict_sizes: np.ndarray,
+                 remaining: int, distance: float, moves: tuple | None, conflicts: tuple | None,
+                 flips: tuple | None):
+        # The people who escaped, as they were when they did
+        self.escaped = escaped
+        self.moved = moved
+        self.flipped = flipped
+        # Number of people in each conflict played in the strip
+        self.conflict_sizes = conflict_sizes
+        self.remaining = remaining
+        # Total distance to an exit of the people still in the strip
+        self.distance = distance
+        # Arrays of (id, from x, from y, to x, to y), (id, won) and (id, strategy value)
+        self.moves = moves
+        self.conflicts = conflicts
+        self.flips = flips
+
+
+class Strip:
+    """
+    The rows top to bottom (exclusive) of the grid, as advanced by one worker
+    process: the people standing there, and the occupancy of those rows plus
+    one halo row on either side. up and down connect to the strips above and
+    below, or are None at the edges of the grid.
+    """
+
+    def __init__(self, cells: EnvironmentArrays, distances: np.ndarray, agents: AgentArrays,
+                 top: int, bottom: int, movement_strategy: MovementStrategy, rng: np.random.Generator,
+                 up: Connection | None, down: Connection | None):
+        self.cells = cells
+        self.distances = distances
+        self.agents = agents
+        self.top = top
+        self.bottom = bottom
+        self.movement_strategy = movement_strategy
+        self.rng = rng
+        self.up = up
+        self.down = down
+        self.occupied = np.zeros(cells.size, dtype=bool)
+        self.occupied[cells.index(agents.x, agents.y)] = True
+
+    def exchange(self, to_up, to_down) -> tuple:
+        """
+        Sends to_up and to_down to the neighbouring strips and returns what they
+        sent back. The upper strip of each pair sends first, so two strips never
+        wait on each other.
+        """
+        from_up = from_down = None
+        if self.up is not None:
+            from_up = self.up.recv()
+            self.up.send(to_up)
+        if self.down is not None:
+            self.down.send(to_down)
+            from_down = self.down.recv()
+        return from_up, from_down
+
+    def row(self, y: int) -> slice:
+        """Row y of the padded occupancy"""
+        start = (y + 1) * self.cells.width
+        return slice(start, start + self.cells.width)
+
+    def exchange_halo(self):
+        """Swaps edge rows with the neighbouring strips, refreshing the halo rows"""
+        from_up, from_down = self.exchange(self.occupied[self.row(self.top)],
+                                           self.occupied[self.row(self.bottom - 1)])
+        if from_up is not None:
+            self.occupied[self.row(self.top - 1)] = from_up
+        if from_down is not None:
+            self.occupied[self.row(self.bottom)] = from_down
+
+    def step(self, record: bool) -> StripReport:
+        """
+        vectorized.advance and end_step for the people in the strip. People
+        moving onto a neighbouring strip play for their cell there: they are
+        sent over as candidates, the strip owning the cell plays its conflicts
+        and keeps the winners, and sends back how each candidate fared.
+        """
+        agents, cells = self.agents, self.cells
+        agents.game_state[:] = PersonGameState.NOT_PLAYED.value
+        choice, moving = find_projected_moves(
+            agents, cells, self.occupied, self.movement_strategy, self.rng)
+        movers = np.flatnonzero(moving)
+        target_x = agents.x.copy()
+        target_y = agents.y.copy()
+        target_x[movers] += DIRECTIONS[choice[movers], 0]
+        target_y[movers] += DIRECTIONS[choice[movers], 1]
+        if self.movement_strategy != MovementStrategy.RANDOM:
+            agents.momentum_x[movers] = DIRECTIONS[choice[movers], 0]
+            agents.momentum_y[movers] = DIRECTIONS[choice[movers], 1]
+        if self.movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
+            agents.familiarity[movers] += 1
+
+        inside = (target_y[movers] >= self.top) & (target_y[movers] < self.bottom)
+        local = movers[inside]
+        leaving = (movers[target_y[movers] < self.top], movers[target_y[movers] >= self.bottom])
+        outgoing = []
+        for index in leaving:
+            candidates = agents.take(index)
+            candidates.x, candidates.y = target_x[index], target_y[index]
+            outgoing.append(candidates)
+        from_up, from_down = self.exchange(*outgoing)
+        arriving = AgentArrays.concatenate([part for part in (from_up, from_down) if part is not None])
+        from_above = len(from_up) if from_up is not None else 0
+
+        # Play the prisoner's dilemma for every contested cell of the strip
+        candidates = AgentArrays.concatenate([agents.take(local), arriving])
+        targets = cells.index(np.r_[target_x[local], arriving.x], np.r_[target_y[local], arriving.y])
+        played, won, conflict_sizes, cooperator_counts, game_sizes = play_conflicts(
+            candidates, np.arange(len(candidates)), targets, self.rng)
+        foreign = played >= len(local)
+        # Uncontested candidates win with a conflict size of 0
+        arriving_won = np.ones(len(arriving), dtype=bool)
+        arriving_sizes = np.zeros(len(arriving), dtype=np.int64)
+        arriving_cooperators = np.zeros(len(arriving), dtype=np.int64)
+        index = played[foreign] - len(local)
+        arriving_won[index] = won[foreign]
+        arriving_sizes[index] = conflict_sizes[foreign]
+        arriving_cooperators[index] = cooperator_counts[foreign]
+        replies = self.exchange(
+            (arriving_won[:from_above], arriving_sizes[:from_above], arriving_cooperators[:from_above]),
+            (arriving_won[from_above:], arriving_sizes[from_above:], arriving_cooperators[from_above:]))
+
+        own = ~foreign
+        players = [local[played[own]]]
+        players_won = [won[own]]
+        sizes = [conflict_sizes[own]]
+        cooperators = [cooperator_counts[own]]
+        departed = np.zeros(len(agents), dtype=bool)
+        for index, reply in zip(leaving, replies):
+            if reply is None:
+                continue
+            reply_won, reply_sizes, reply_cooperators = reply
+            contested = reply_sizes > 0
+            players.append(index[contested])
+            players_won.append(reply_won[contested])
+            sizes.append(reply_sizes[contested])
+            cooperators.append(reply_cooperators[contested])
+            departed[index[reply_won]] = True
+        players = np.concatenate(players)
+        players_won = np.concatenate(players_won)
+        losers = players[~players_won]
+        agents.game_state[players] = np.where(
+            players_won, PersonGameState.WON.value, PersonGameState.LOST.value)
+        target_x[losers] = agents.x[losers]
+        target_y[losers] = agents.y[losers]
+        agents.momentum_x[losers] = 0
+        agents.momentum_y[losers] = 0
+        agents.history_conflicts[players] += np.concatenate(sizes)
+        agents.history_cooperators[players] += np.concatenate(cooperators)
+
+        contested = arriving_sizes > 0
+        arriving.game_state[contested & arriving_won] = PersonGameState.WON.value
+        arriving.history_conflicts += arriving_sizes
+        arriving.history_cooperators += arriving_cooperators
+        arrived = arriving.take(arriving_won)
+
+        # Move each player; those who left are reported here and kept by the strip they moved to
+        moved = (target_x != agents.x) | (target_y != agents.y)
+        old_x, old_y = agents.x[moved], agents.y[moved]
+        self.occupied[cells.index(old_x, old_y)] = False
+        agents.x, agents.y = target_x, target_y
+        moves = (agents.id_num[moved], old_x, old_y, agents.x[moved], agents.y[moved]) if record else None
+        conflicts = (candidates.id_num[played], won) if record else None
+        moved_count = np.count_nonzero(moved)
+        if departed.any():
+            agents.keep(~departed)
+            moved = moved[~departed]
+        if len(arrived):
+            agents = self.agents = AgentArrays.concatenate([agents, arrived])
+            moved = np.r_[moved, np.ones(len(arrived), dtype=bool)]
+        escaped = cells.exits[cells.index(agents.x, agents.y)]
+        staying = moved & ~escaped
+        self.occupied[cells.index(agents.x[staying], agents.y[staying])] = True
+        escaped_agents = agents.take(escaped)
+
+        flipped = end_step(agents, escaped, self.rng)
+        flips = (agents.id_num[flipped], agents.strategy[flipped]) if record else None
+        self.exchange_halo()
+        return StripReport(escaped_agents, moved_count, np.count_nonzero(flipped), game_sizes,
+                           len(agents), float(self.distances[agents.y, agents.x].sum()),
+                           moves, conflicts, flips)
+
+
+def run_strip(shared_cells: SharedArrays, shared_distances: SharedArrays, agents: AgentArrays, top: int, bottom: int,
+              movement_strategy: MovementStrategy, rng: np.random.Generator, record: bool,
+              parent: Connection, up: Connection | None, down: Connection | None, others: list[Connection]):
+    """
+    Worker process of one strip: steps for as long as the parent says to,
+    then sends back the people left in the strip. The environment arrays are
+    the parent's, in shared memory. others are the pipe ends this worker
+    inherited but does not own; they are closed first, so that the strips
+    next to a failed one see its pipes close instead of waiting forever.
+    """
+    for connection in others:
+        connection.close()
+    try:
+        strip = Strip(EnvironmentArrays.attach(shared_cells), shared_distances['distances'], agents,
+                      top, bottom, movement_strategy, rng, up, down)
+        strip.exchange_halo()
+        while parent.recv():
+            parent.send(strip.step(record))
+        parent.send(strip.agents)
+    except BaseException as error:
+        parent.send(error)
+        raise
+
+
+def raise_failure(connections: list[Connection], processes: list[multiprocessing.Process],
+                  strip: int, error: BaseException):
+    """
+    Raises the error of the strip that failed first. The strips next to it
+    fail too, with broken pipes, but it sent its own error before exiting,
+    unless it was killed outright.
+    """
+    failures = [(strip, error)]
+    for other, connection in enumerate(connections):
+        try:
+            if other != strip and connection.poll():
+                message = connection.recv()
+                if isinstance(message, BaseException):
+                    failures.append((other, message))
+        except (OSError, EOFError):
+            pass
+    root = [failure for failure in failures if not isinstance(failure[1], (ConnectionError, EOFError))]
+    if not root:
+        for other, process in enumerate(processes):
+            process.join(timeout=0.1)
+            if process.exitcode not in (None, 0, 1):
+                raise RuntimeError(f"strip {other} exited with code {process.exitcode} without answering")
+    strip, error = (root or failures)[0]
+    raise RuntimeError(f"strip {strip} failed") from error
+
+
+def receive(connections: list[Connection], processes: list[multiprocessing.Process]) -> list:
+    """
+    The next message from every strip, in strip order. Raises as soon as one
+    strip fails or exits without answering, rather than waiting on strips that
+    may be stuck waiting on it.
+    """
+    messages: dict[int, object] = {}
+    while len(messages) < len(connections):
+        pending = [strip for strip in range(len(connections)) if strip not in messages]
+        ready = wait([connections[strip] for strip in pending] + [processes[strip].sentinel for strip in pending])
+        for strip in pending:
+            if connections[strip] in ready:
+                try:
+                    message = connections[strip].recv()
+                except EOFError:
+                    message = None
+                if isinstance(message, BaseException):
+                    raise_failure(connections, processes, strip, message)
+                if message is not None:
+                    messages[strip] = message
+                    continue
+            if connections[strip] in ready or processes[strip].sentinel in ready:
+                processes[strip].join()
+                raise RuntimeError(f"strip {strip} exited with code {processes[strip].exitcode} without answering")
+    return [messages[strip] for strip in range(len(connections))]
+
+
+def strip_game_loop(env: Environment, visualizers: list[GenericVisualization], movement_strategy: MovementStrategy,
+                    rng: np.random.Generator, verbose: bool, workers: int, profiler: NullProfiler | None = None,
+                    stop: StopConditions | None = None):
+    """
+    vectorized_game_loop with the grid split into horizontal strips, each
+    advanced by its own worker process. Neighbouring strips exchange the
+    people moving between them and their edge rows every step.
+    Each strip draws from its own stream spawned from rng, so results are
+    reproducible for a fixed number of workers; a single strip draws from rng
+    itself and matches the NumPy engine.
+    """
+    if profiler is None:
+        profiler = NullProfiler()
+    if stop is None:
+        stop = StopConditions()
+    workers = max(1, min(workers, env.height))
+    bounds = strip_bounds(env.height, workers)
+    people = list(env.people.values())
+    by_id = {person.id_num: person for person in people}
+    agents = AgentArrays.from_people(people)
+    # Person objects stay here; the workers only need the arrays
+    agents.people[:] = None
+    strip_of = np.searchsorted(bounds, agents.y, side='right') - 1
+    streams = [rng] if workers == 1 else rng.spawn(workers)
+    env.occupancy.fill(EMPTY)
+
+    def attach(part: AgentArrays) -> AgentArrays:
+        part.people = np.empty(len(part), dtype=object)
+        part.people[:] = [by_id[id_num] for id_num in part.id_num.tolist()]
+        return part
+
+    record = bool(visualizers)
+    connections: list[Connection] = []
+    processes: list[multiprocessing.Process] = []
+    boundaries = [multiprocessing.Pipe() for _ in range(workers - 1)]
+    # Published once for every strip to read, and unlinked below whatever happens
+    published: list[SharedArrays] = []
+    try:
+        shared_cells = EnvironmentArrays(env).share()
+        published.append(shared_cells)
+        shared_distances = SharedArrays({'distances': exit_distances(env)})
+        published.append(shared_distances)
+        for strip in range(workers):
+            parent, child = multiprocessing.Pipe()
+            up = boundaries[strip - 1][1] if strip > 0 else None
+            down = boundaries[strip][0] if strip < workers - 1 else None
+            others = [end for pipe in boundaries for end in pipe if end is not up and end is not down] + connections
+            process = multiprocessing.Process(
+                target=run_strip, daemon=True,
+                args=(shared_cells, shared_distances, agents.take(strip_of == strip), int(bounds[strip]), int(bounds[strip + 1]),
+                      movement_strategy, streams[strip], record, child, up, down, others))
+            process.start()
+            child.close()
+            connections.append(parent)
+            processes.append(process)
+        for upper, lower in boundaries:
+            upper.close()
+            lower.close()
+
+        iteration = 0
+        remaining = len(agents)
+        flips: list[tuple[int, PersonStrategy]] = []
+        reason = StopReason.EVACUATED
+        profiler.lap("setup")
+        while remaining > 0:
+            profiler.start_step()
+            if verbose:
+                print(f"Iteration {iteration}:")
+            for connection in connections:
+                connection.send(True)
+            reports: list[StripReport] = receive(connections, processes)
+            profiler.lap("strips")
+
+            escaped = attach(AgentArrays.concatenate([report.escaped for report in reports]))
+            escaped.sync()
+            for person in escaped.people:
+                env.escape_person(person)
+            profiler.lap("move")
+
+            if visualizers:
+                moves = [move for report in reports for move in zip(*(array.tolist() for array in report.moves))]
+                conflicts = [conflict for report in reports
+                             for conflict in zip(*(array.tolist() for array in report.conflicts))]
+                events = StepEvents(iteration + 1, strategy_flips=flips, moves=moves,
+                                    escapes=escaped.id_num.tolist(), conflicts=conflicts)
+                [visualizer.record_step(events) for visualizer in visualizers]
+                flips = [(id_num, STRATEGIES[code]) for report in reports
+                         for id_num, code in zip(report.flips[0].tolist(), report.flips[1].tolist())]
+            profiler.lap("record_step")
+            conflict_sizes = np.concatenate([report.conflict_sizes for report in reports])
+            profiler.count(sum(report.moved for report in reports), len(escaped),
+                           sum(report.flipped for report in reports), conflict_sizes)
+            profiler.end_step()
+            if verbose:
+                print(f"\t{len(conflict_sizes)} conflicts and {len(escaped)} escapes across {workers} strips")
+                print()
+            iteration += 1
+            remaining = sum(report.remaining for report in reports)
+            if remaining > 0:
+                distance = sum(report.distance for report in reports)
+                moved = sum(report.moved for report in reports)
+                stalled = stop.stalled(np.array([len(escaped)]), np.array([moved]), np.array([distance]))[0]
+                cut_short = StopReason.STALLED if stalled else stop.out_of_budget(iteration)
+                profiler.lap("stop_check")
+                if cut_short is not None:
+                    reason = cut_short
+                    break
+
+        for connection in connections:
+            connection.send(False)
+        left = attach(AgentArrays.concatenate(receive(connections, processes)))
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for shared in published:
+            shared.close()
+            shared.unlink()
+
+    if len(left) > 0:
+        # Leave the environment holding the people who did not escape
+        left.sync()
+        env.occupancy[left.y, left.x] = left.id_num
+    if verbose:
+        if reason == StopReason.EVACUATED:
+            print(f"All people have evacuated in {iteration} iterations.")
+        else:
+            print(f"Stopped after {iteration} iterations ({reason.name}) with {len(left)} people left.")
+        escaped_people: list[Person] = env.escaped_people  # type: ignore
+        print(
+            f"Escaped people: {[p.id_num for p in escaped_people]}")
+
+    [visualizer.record_stop(reason) for visualizer in visualizers]
+    [visualizer.export(verbose) for visualizer in visualizers]
+    profiler.lap("export")
@@ -0,0 +1,558 @@
+import numpy as np
+from environment import Environment, SharedArrays
+from environment.environment import DIRECTIONS as DIRECTION_LIST, EMPTY, WALKABLE_CODES
+from person import Person, MovementStrategy, PersonStrategy, PersonGameState
+from visualization import GenericVisualization, CountingVisualization, StepEvents, StopReason
+from .profiler import NullProfiler
+from .stopping import StopConditions, exit_distances
+
+DIRECTIONS = np.array(DIRECTION_LIST, dtype=np.int64)
+
+STRATEGIES = {strategy.value: strategy for strategy in PersonStrategy}
+GAME_STATES = {state.value: state for state in PersonGameState}
+
+
+class AgentArrays:
+    """
+    Structure-of-arrays view of the people still in the environment.
+    Index i of every array describes the same person, people[i], who lives in
+    replicate replicate[i]. People are ordered by replicate, so the arrays are
+    a ragged replicate-major layout when several replicates run together.
+    """
+
+    def __init__(self, count: int):
+        self.people = np.empty(count, dtype=object)
+        self.id_num = np.zeros(count, dtype=np.int64)
+        self.replicate = np.zeros(count, dtype=np.int64)
+        self.x = np.zeros(count, dtype=np.int64)
+        self.y = np.zeros(count, dtype=np.int64)
+        self.momentum_x = np.zeros(count, dtype=np.int64)
+        self.momentum_y = np.zeros(count, dtype=np.int64)
+        self.familiarity = np.zeros(count, dtype=np.float64)
+        self.strategy = np.zeros(count, dtype=np.int8)
+        self.game_state = np.full(
+            count, PersonGameState.NOT_PLAYED.value, dtype=np.int8)
+        self.strategy_inertia = np.zeros(count, dtype=np.float64)
+        self.update_interval = np.ones(count, dtype=np.int64)
+        self.p_value = np.zeros(count, dtype=np.float64)
+        # Running sums over Person.history; only the sums are ever used
+        self.history_length = np.zeros(count, dtype=np.int64)
+        self.history_conflicts = np.zeros(count, dtype=np.int64)
+        self.history_cooperators = np.zeros(count, dtype=np.int64)
+
+    @classmethod
+    def from_people(cls, people: list[Person]) -> 'AgentArrays':
+        agents = cls(len(people))
+        agents.people[:] = people
+        agents.id_num[:] = [p.id_num for p in people]
+        agents.x[:] = [p.x for p in people]
+        agents.y[:] = [p.y for p in people]
+        agents.momentum_x[:] = [p.momentum[0] for p in people]
+        agents.momentum_y[:] = [p.momentum[1] for p in people]
+        agents.familiarity[:] = [p.familiarity for p in people]
+        agents.strategy[:] = [p.strategy.value for p in people]
+        agents.game_state[:] = [p.game_state.value for p in people]
+        agents.strategy_inertia[:] = [p.strategy_inertia for p in people]
+        agents.update_interval[:] = [p.update_interval for p in people]
+        agents.p_value[:] = [p.p_value for p in people]
+        agents.history_length[:] = [len(p.history) for p in people]
+        agents.history_conflicts[:] = [sum(record[0] for record in p.history)
+                                       for p in people]
+        agents.history_cooperators[:] = [sum(record[1] for record in p.history)
+                                         for p in people]
+        return agents
+
+    @classmethod
+    def spawn(cls, env: Environment, replicates: int, cooperate_percent: float, update_interval: int,
+              strategy_inertia: float, spawn_percent: float, familiarity: int, p_value: float,
+              rng: np.random.Generator) -> 'AgentArrays':
+        """
+        simulation.spawn_people for several independent replicates at once,
+        without creating Person objects.
+        """
+        spawn_points = np.array(env.spawn_points, dtype=np.int64).reshape(-1, 2)
+        spawn_count = int(len(spawn_points) * spawn_percent)
+        cooperate_count = int(spawn_count * cooperate_percent)
+        strategies = np.array([PersonStrategy.COOPERATE.value] * cooperate_count +
+                              [PersonStrategy.DEFECT.value] * (spawn_count - cooperate_count), dtype=np.int8)
+
+        agents = cls(replicates * spawn_count)
+        agents.replicate[:] = np.repeat(np.arange(replicates), spawn_count)
+        agents.id_num[:] = np.tile(np.arange(1, spawn_count + 1), replicates)
+        chosen = np.concatenate([rng.permutation(len(spawn_points))[:spawn_count]
+                                 for _ in range(replicates)])
+        agents.x[:] = spawn_points[chosen, 0]
+        agents.y[:] = spawn_points[chosen, 1]
+        agents.strategy[:] = np.concatenate([rng.permutation(strategies)
+                                             for _ in range(replicates)])
+        agents.familiarity[:] = familiarity
+        agents.strategy_inertia[:] = strategy_inertia
+        agents.update_interval[:] = update_interval
+        agents.p_value[:] = p_value
+        return agents
+
+    def __len__(self):
+        return len(self.people)
+
+    @classmethod
+    def concatenate(cls, parts: list['AgentArrays']) -> 'AgentArrays':
+        """The people of every part, in order"""
+        agents = cls(0)
+        for name, value in vars(agents).items():
+            setattr(agents, name, np.concatenate([value] + [getattr(part, name) for part in parts]))
+        return agents
+
+    def keep(self, mask: np.ndarray):
+        """Drop every person whose entry in mask is False"""
+        for name, value in vars(self).items():
+            setattr(self, name, value[mask])
+
+    def take(self, index: np.ndarray) -> 'AgentArrays':
+        """A copy holding only the people selected by index, a mask or an index array"""
+        agents = AgentArrays(0)
+        for name, value in vars(self).items():
+            setattr(agents, name, value[index])
+        return agents
+
+    def sync(self, mask: np.ndarray | None = None):
+        """Write the array state back onto the Person objects"""
+        index = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        for i, person in zip(index.tolist(), self.people[index]):
+            person.x = int(self.x[i])
+            person.y = int(self.y[i])
+            person.projected_x = person.x
+            person.projected_y = person.y
+            person.momentum = (int(self.momentum_x[i]),
+                               int(self.momentum_y[i]))
+            person.familiarity = int(self.familiarity[i])
+            person.strategy = STRATEGIES[int(self.strategy[i])]
+            person.game_state = GAME_STATES[int(self.game_state[i])]
+
+
+class EnvironmentArrays:
+    """
+    Immutable per-cell arrays of an environment, padded by one obstacle cell
+    on every side so that neighbour lookups never go out of bounds. They are
+    shared by every replicate; only the occupancy is per replicate.
+    """
+
+    def __init__(self, env: Environment):
+        self.width = env.width + 2
+        self.height = env.height + 2
+        self.size = self.width * self.height
+        self.walkable = np.pad(np.isin(env.terrain, WALKABLE_CODES), 1).ravel()
+        self.exits = np.pad(env.terrain == ord('E'), 1).ravel()
+        self.static_field = np.pad(env.static_field, 1,
+                                   constant_values=-np.inf).ravel()
+        self.offsets = DIRECTIONS[:, 1] * self.width + DIRECTIONS[:, 0]
+
+    def share(self) -> SharedArrays:
+        """Publishes the arrays in shared memory, for worker processes to attach() to"""
+        shape = (self.height, self.width)
+        return SharedArrays({'walkable': self.walkable.reshape(shape), 'exits': self.exits.reshape(shape),
+                             'static_field': self.static_field.reshape(shape)})
+
+    @classmethod
+    def attach(cls, shared: SharedArrays) -> 'EnvironmentArrays':
+        """The arrays another process published with share(), as read-only views"""
+        cells = cls.__new__(cls)
+        cells.height, cells.width = shared['walkable'].shape
+        cells.size = cells.width * cells.height
+        cells.walkable = shared['walkable'].ravel()
+        cells.exits = shared['exits'].ravel()
+        cells.static_field = shared['static_field'].ravel()
+        cells.offsets = DIRECTIONS[:, 1] * cells.width + DIRECTIONS[:, 0]
+        return cells
+
+    def index(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Flat index into the padded arrays of the unpadded cell (x, y)"""
+        return (y + 1) * self.width + (x + 1)
+
+    def occupancy_index(self, x: np.ndarray, y: np.ndarray, replicate: np.ndarray) -> np.ndarray:
+        """Flat index of the cell (x, y) of a replicate in the stacked occupancy arrays"""
+        return replicate * self.size + self.index(x, y)
+
+
+def find_projected_moves(agents: AgentArrays, cells: EnvironmentArrays, occupied: np.ndarray,
+                         movement_strategy: MovementStrategy, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized Person.findProjectedMove for every person at once.
+    Returns the index of the chosen direction for each person and a mask of
+    the people that have somewhere to go.
+    """
+    position = cells.index(agents.x, agents.y)
+    neighbours = position[:, None] + cells.offsets[None, :]
+    open_cells = cells.walkable[neighbours] & \
+        ~occupied[(agents.replicate * cells.size)[:, None] + neighbours]
+
+    if movement_strategy == MovementStrategy.RANDOM:
+        weights = open_cells.astype(np.float64)
+    else:
+        # Equation 2 from the paper, computed in log space and rescaled per
+        # person so that large familiarities cannot overflow
+        field = cells.static_field[neighbours]
+        open_exits = open_cells & cells.exits[neighbours]
+        usable = open_cells & ~open_exits & np.isfinite(field)
+        log_weights = np.where(
+            usable, agents.familiarity[:, None] * np.where(usable, field, 0.0), -np.inf)
+        if movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
+            dx = DIRECTIONS[None, :, 0] - agents.momentum_x[:, None]
+            dy = DIRECTIONS[None, :, 1] - agents.momentum_y[:, None]
+            log_weights += 3 - np.sqrt(dx * dx + dy * dy)
+        peak = log_weights.max(axis=1, keepdims=True)
+        peak[~np.isfinite(peak)] = 0.0
+        weights = np.exp(log_weights - peak)
+        # If at exit ignore non-exits
+        at_exit = open_exits.any(axis=1)
+        weights[at_exit] = open_exits[at_exit]
+
+    cumulative = np.cumsum(weights, axis=1)
+    total = cumulative[:, -1]
+    draws = rng.random(len(agents)) * total
+    # A draw rounded up to the total picks the last move that can be taken
+    last_open = 7 - np.argmax(weights[:, ::-1] > 0, axis=1)
+    choice = np.minimum((cumulative <= draws[:, None]).sum(axis=1), last_open)
+    return choice, total > 0
+
+
+def play_conflicts(agents: AgentArrays, movers: np.ndarray, targets: np.ndarray,
+                   rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized prisoners_dilemma for every contested cell at once.
+    Returns the players, whether each one won, the conflict size and
+    cooperator count of the game they played, and the size of each game.
+    """
+    cooperating = agents.strategy[movers] == PersonStrategy.COOPERATE.value
+    # Group by target cell; within a cell, the random priority picks the winner
+    priority = rng.random(len(movers))
+    order = np.lexsort((priority, targets))
+    sorted_targets = targets[order]
+    starts = np.flatnonzero(
+        np.r_[True, sorted_targets[1:] != sorted_targets[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    contested = sizes > 1
+    players = order[np.repeat(contested, sizes)]
+    sizes = sizes[contested]
+    game = np.repeat(np.arange(len(sizes)), sizes)
+    cooperators = np.bincount(
+        game, weights=cooperating[players], minlength=len(sizes)).astype(np.int64)
+    defectors = sizes - cooperators
+
+    # Eligible winners are cooperators when everyone cooperates, else defectors
+    eligible = np.where(defectors[game] == 0,
+                        cooperating[players], ~cooperating[players])
+    ranked = np.lexsort((np.where(eligible, priority[players], -1.0), game))
+    candidate = ranked[np.cumsum(sizes) - 1]
+    # competition between all defectors
+    p_value = agents.p_value[movers[players[candidate]]]
+    has_winner = (defectors <= 1) | (
+        rng.random(len(sizes)) < 1 / np.maximum(defectors, 1) ** (p_value - 1))
+
+    won = np.zeros(len(players), dtype=bool)
+    won[candidate[has_winner]] = True
+    return movers[players], won, sizes[game], cooperators[game], sizes
+
+
+def update_strategies(agents: AgentArrays, rng: np.random.Generator) -> np.ndarray:
+    """
+    Vectorized Person.update_strategy; history lengths and sums must already
+    include the current step. Returns a mask of the people who switched.
+    """
+    due = (agents.history_length % agents.update_interval == 0) & (
+        agents.history_conflicts > 0)
+    conflicts = agents.history_conflicts
+    cooperators = agents.history_cooperators
+    cooperating = agents.strategy == PersonStrategy.COOPERATE.value
+
+    all_cooperated = conflicts == cooperators
+    share = 1 / np.maximum(cooperators, 1)
+    defected = conflicts - cooperators > 1
+    punishment = 1 / np.maximum(conflicts - cooperators, 1) ** agents.p_value
+
+    current_payoff = np.zeros(len(agents))
+    opposite_payoff = np.zeros(len(agents))
+    current_payoff[all_cooperated] = np.where(
+        cooperating, share, 1.0)[all_cooperated]
+    opposite_payoff[all_cooperated] = np.where(
+        cooperating, 1.0, share)[all_cooperated]
+    current_payoff[defected] = np.where(
+        cooperating, 0.0, punishment)[defected]
+    opposite_payoff[defected] = np.where(
+        cooperating, punishment, 0.0)[defected]
+
+    current_payoff *= agents.strategy_inertia
+    with np.errstate(over='ignore'):
+        probability = 1 / (1 + np.exp((current_payoff - opposite_payoff) / 0.1))
+    flip = due & (rng.random(len(agents)) <= probability)
+    agents.strategy[flip] = np.where(
+        cooperating[flip], PersonStrategy.DEFECT.value, PersonStrategy.COOPERATE.value)
+
+    agents.history_length[due] = 0
+    agents.history_conflicts[due] = 0
+    agents.history_cooperators[due] = 0
+    return flip
+
+
+class StepOutcome:
+    """What happened to the people of one vectorized step"""
+
+    def __init__(self, moved: np.ndarray, old_x: np.ndarray, old_y: np.ndarray, escaped: np.ndarray,
+                 players: np.ndarray, won: np.ndarray, conflict_sizes: np.ndarray):
+        self.moved = moved
+        self.old_x = old_x
+        self.old_y = old_y
+        self.escaped = escaped
+        self.players = players
+        self.won = won
+        # Number of people in each conflict
+        self.conflict_sizes = conflict_sizes
+
+
+def advance(agents: AgentArrays, cells: EnvironmentArrays, occupied: np.ndarray,
+            movement_strategy: MovementStrategy, rng: np.random.Generator,
+            profiler: NullProfiler | None = None) -> StepOutcome:
+    """
+    Projected moves, conflicts and moves of one step for every person at once.
+    People who escaped are left in the arrays at their exit until end_step.
+    """
+    if profiler is None:
+        profiler = NullProfiler()
+    agents.game_state[:] = PersonGameState.NOT_PLAYED.value
+    choice, moving = find_projected_moves(
+        agents, cells, occupied, movement_strategy, rng)
+    movers = np.flatnonzero(moving)
+    target_x = agents.x.copy()
+    target_y = agents.y.copy()
+    target_x[movers] += DIRECTIONS[choice[movers], 0]
+    target_y[movers] += DIRECTIONS[choice[movers], 1]
+    if movement_strategy != MovementStrategy.RANDOM:
+        agents.momentum_x[movers] = DIRECTIONS[choice[movers], 0]
+        agents.momentum_y[movers] = DIRECTIONS[choice[movers], 1]
+    if movement_strategy == MovementStrategy.STATIC_FIELD_WITH_MOMENTUM:
+        agents.familiarity[movers] += 1
+    profiler.lap("projected_moves")
+
+    # Play the prisoner's dilemma if any two people have the same projected moves
+    players, won, conflict_sizes, cooperator_counts, game_sizes = play_conflicts(
+        agents, movers, cells.occupancy_index(target_x[movers], target_y[movers], agents.replicate[movers]), rng)
+    losers = players[~won]
+    agents.game_state[players] = np.where(
+        won, PersonGameState.WON.value, PersonGameState.LOST.value)
+    target_x[losers] = agents.x[losers]
+    target_y[losers] = agents.y[losers]
+    agents.momentum_x[losers] = 0
+    agents.momentum_y[losers] = 0
+    agents.history_conflicts[players] += conflict_sizes
+    agents.history_cooperators[players] += cooperator_counts
+    profiler.lap("prisoners_dilemma")
+
+    # Move each player
+    moved = (target_x != agents.x) | (target_y != agents.y)
+    old_x, old_y = agents.x[moved], agents.y[moved]
+    occupied[cells.occupancy_index(old_x, old_y, agents.replicate[moved])] = False
+    agents.x, agents.y = target_x, target_y
+    escaped = cells.exits[cells.index(agents.x, agents.y)]
+    staying = moved & ~escaped
+    occupied[cells.occupancy_index(agents.x[staying], agents.y[staying],
+                                   agents.replicate[staying])] = True
+    profiler.lap("move")
+    return StepOutcome(moved, old_x, old_y, escaped, players, won, game_sizes)
+
+
+def end_step(agents: AgentArrays, escaped: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Drop the people who escaped and update everyone else's strategy.
+    Returns a mask of the remaining people who switched strategy.
+    """
+    agents.keep(~escaped)
+    agents.history_length += 1
+    flips = update_strategies(agents, rng)
+    agents.game_state[:] = PersonGameState.NOT_PLAYED.value
+    return flips
+
+
+def step_events(step: int, agents: AgentArrays, outcome: StepOutcome,
+                flips: list[tuple[int, PersonStrategy]]) -> StepEvents:
+    """Builds the visualizer events of one step from its outcome, before end_step"""
+    moved = outcome.moved
+    moves = list(zip(agents.id_num[moved].tolist(), outcome.old_x.tolist(), outcome.old_y.tolist(),
+                     agents.x[moved].tolist(), agents.y[moved].tolist()))
+    conflicts = list(zip(agents.id_num[outcome.players].tolist(),
+                         outcome.won.tolist()))
+    return StepEvents(step, strategy_flips=flips, moves=moves,
+                      escapes=agents.id_num[outcome.escaped].tolist(), conflicts=conflicts)
+
+
+def vectorized_game_loop(env: Environment, visualizers: list[GenericVisualization], movement_strategy: MovementStrategy,
+                         rng: np.random.Generator, verbose: bool, profiler: NullProfiler | None = None,
+                         stop: StopConditions | None = None):
+    """
+    Drop-in replacement for simulation.game_loop that advances every person
+    at once with NumPy instead of one Person at a time.
+    """
+    if profiler is None:
+        profiler = NullProfiler()
+    if stop is None:
+        stop = StopConditions()
+    distances = exit_distances(env)
+    people = list(env.people.values())
+    agents = AgentArrays.from_people(people)
+    cells = EnvironmentArrays(env)
+    occupied = np.zeros(cells.size, dtype=bool)
+    occupied[cells.index(agents.x, agents.y)] = True
+    # Occupancy lives in the arrays; visualizers follow the step events
+    env.occupancy.fill(EMPTY)
+
+    iteration = 0
+    flips: list[tuple[int, PersonStrategy]] = []
+    reason = StopReason.EVACUATED
+    profiler.lap("setup")
+    while len(agents) > 0:
+        profiler.start_step()
+        if verbose:
+            print(f"Iteration {iteration}:")
+        outcome = advance(agents, cells, occupied,
+                          movement_strategy, rng, profiler)
+        if verbose:
+            won = np.count_nonzero(outcome.won)
+            print(f"\t{len(outcome.players)} people in {won} won and "
+                  f"{len(outcome.players) - won} lost conflicts")
+
+        escaped = outcome.escaped
+        agents.sync(escaped)
+        for person in agents.people[escaped]:
+            env.escape_person(person)
+        profiler.lap("move")
+
+        if visualizers:
+            events = step_events(iteration + 1, agents, outcome, flips)
+            [visualizer.record_step(events) for visualizer in visualizers]
+        profiler.lap("record_step")
+        if verbose:
+            print(f"Updating strategies...")
+        moved = np.count_nonzero(outcome.moved)
+        escapes = np.count_nonzero(escaped)
+        flipped = end_step(agents, escaped, rng)
+        if visualizers:
+            flips = list(zip(agents.id_num[flipped].tolist(),
+                             [STRATEGIES[code] for code in agents.strategy[flipped].tolist()]))
+        profiler.lap("update_strategy")
+        profiler.count(moved, escapes, np.count_nonzero(flipped), outcome.conflict_sizes)
+        profiler.end_step()
+        iteration += 1
+        if verbose:
+            print()
+        if len(agents) > 0:
+            distance = distances[agents.y, agents.x].sum()
+            stalled = stop.stalled(np.array([escapes]), np.array([moved]), np.array([distance]))[0]
+            cut_short = StopReason.STALLED if stalled else stop.out_of_budget(iteration)
+            profiler.lap("stop_check")
+            if cut_short is not None:
+                reason = cut_short
+                # Leave the environment holding the people who did not escape
+                agents.sync()
+                env.occupancy[agents.y, agents.x] = agents.id_num
+                break
+    if verbose:
+        if reason == StopReason.EVACUATED:
+            print(f"All people have evacuated in {iteration} iterations.")
+        else:
+            print(f"Stopped after {iteration} iterations ({reason.name}) with {len(agents)} people left.")
+        escaped_people: list[Person] = env.escaped_people  # type: ignore
+        print(
+            f"Escaped people: {[p.id_num for p in escaped_people]}")
+
+    [visualizer.record_stop(reason) for visualizer in visualizers]
+    [visualizer.export(verbose) for visualizer in visualizers]
+    profiler.lap("export")
+
+
+def replicate_game_loop(env: Environment, visualizers: list[CountingVisualization], movement_strategy: MovementStrategy,
+                        cooperate_percent: float, update_interval: int, strategy_inertia: float,
+                        spawn_percent: float, familiarity: int, p_value: float,
+                        rng: np.random.Generator, verbose: bool, profiler: NullProfiler | None = None,
+                        stop: StopConditions | None = None):
+    """
+    Runs one independent replicate of the scenario per visualizer, advancing all
+    of them together as a single array computation. Replicates share the
+    environment arrays and the random generator, and a replicate whose people
+    have all escaped, or that stalled, stops being recorded.
+    """
+    replicates = len(visualizers)
+    if profiler is None:
+        profiler = NullProfiler()
+    if stop is None:
+        stop = StopConditions(replicates=replicates)
+    distances = exit_distances(env)
+    cells = EnvironmentArrays(env)
+    profiler.lap("setup")
+    agents = AgentArrays.spawn(env, replicates=replicates, cooperate_percent=cooperate_percent,
+                               update_interval=update_interval, strategy_inertia=strategy_inertia,
+                               spawn_percent=spawn_percent, familiarity=familiarity, p_value=p_value, rng=rng)
+    occupied = np.zeros(replicates * cells.size, dtype=bool)
+    occupied[cells.occupancy_index(agents.x, agents.y, agents.replicate)] = True
+
+    strategy_codes = len(PersonStrategy) + 1
+    escaped_count = np.zeros(replicates, dtype=np.int64)
+    escaped_strategies = np.zeros((replicates, strategy_codes), dtype=np.int64)
+
+    def record_step(active: np.ndarray):
+        strategy_count = escaped_strategies + np.bincount(
+            agents.replicate * strategy_codes + agents.strategy,
+            minlength=replicates * strategy_codes).reshape(replicates, strategy_codes)
+        for replicate in np.flatnonzero(active).tolist():
+            visualizers[replicate].record_counts(
+                int(escaped_count[replicate]),
+                {strategy: int(strategy_count[replicate, strategy.value]) for strategy in PersonStrategy})
+
+    profiler.lap("spawn")
+    record_step(np.ones(replicates, dtype=bool))
+    profiler.lap("record_step")
+    iteration = 0
+    reasons = [StopReason.EVACUATED] * replicates
+    while len(agents) > 0:
+        profiler.start_step()
+        active = np.bincount(agents.replicate, minlength=replicates) > 0
+        outcome = advance(agents, cells, occupied,
+                          movement_strategy, rng, profiler)
+        escaped = outcome.escaped
+        step_escapes = np.bincount(agents.replicate[escaped], minlength=replicates)
+        step_moves = np.bincount(agents.replicate[outcome.moved], minlength=replicates)
+        escaped_count += step_escapes
+        np.add.at(escaped_strategies,
+                  (agents.replicate[escaped], agents.strategy[escaped]), 1)
+        profiler.lap("move")
+        record_step(active)
+        profiler.lap("record_step")
+        moved = np.count_nonzero(outcome.moved)
+        escapes = np.count_nonzero(escaped)
+        flipped = end_step(agents, escaped, rng)
+        profiler.lap("update_strategy")
+        profiler.count(moved, escapes, np.count_nonzero(flipped), outcome.conflict_sizes)
+        profiler.end_step()
+        iteration += 1
+        if verbose and iteration % 100 == 0:
+            print(f"Iteration {iteration}: {np.count_nonzero(active)} of {replicates} replicates still running")
+
+        remaining = np.bincount(agents.replicate, minlength=replicates) > 0
+        distance = np.bincount(agents.replicate, weights=distances[agents.y, agents.x], minlength=replicates)
+        stalled = stop.stalled(step_escapes, step_moves, distance) & remaining
+        if stalled.any():
+            for replicate in np.flatnonzero(stalled).tolist():
+                reasons[replicate] = StopReason.STALLED
+            agents.keep(~stalled[agents.replicate])
+            remaining &= ~stalled
+        cut_short = stop.out_of_budget(iteration)
+        profiler.lap("stop_check")
+        if cut_short is not None and remaining.any():
+            for replicate in np.flatnonzero(remaining).tolist():
+                reasons[replicate] = cut_short
+            break
+    if verbose:
+        evacuated = reasons.count(StopReason.EVACUATED)
+        print(f"{evacuated} of {replicates} replicates evacuated in {iteration} iterations.")
+
+    for visualizer, reason in zip(visualizers, reasons):
+        visualizer.record_stop(reason)
+    [visualizer.export(verbose) for visualizer in visualizers]
+    profiler.lap("export")
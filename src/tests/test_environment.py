@@ -0,0 +1,28 @@
+import numpy as np
+from environment import Environment
+
+MAP = """\
+// A comment block before the map
+//
+#####
+#S  #
+#   E
+#####
+"""
+
+
+def test_newline_terminated_file_is_parsed_as_a_strided_view(monkeypatch):
+    strided = []
+    as_strided = np.lib.stride_tricks.as_strided
+
+    def record(*args, **kwargs):
+        strided.append(kwargs.get('shape'))
+        return as_strided(*args, **kwargs)
+
+    monkeypatch.setattr(np.lib.stride_tricks, 'as_strided', record)
+    env = Environment(text=MAP)
+
+    assert strided == [(4, 5)]
+    assert str(env) == MAP.split('//\n')[1]
+    assert env.exits == [(4, 2)]
+    assert env.spawn_points == [(1, 1)]
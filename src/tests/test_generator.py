@@ -0,0 +1,8 @@
+import pytest
+from environment import generate_venue
+
+
+@pytest.mark.parametrize("exits", [0, -1])
+def test_venue_without_exits_is_rejected(exits):
+    with pytest.raises(ValueError):
+        generate_venue(20, 20, exits=exits)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from environment import Environment
+from person import MovementStrategy
+from simulation.vectorized import AgentArrays, EnvironmentArrays, find_projected_moves
+
+MAP = """\
+#####
+#S  #
+#   E
+#####
+"""
+
+
+class TopDraws:
+    """Stands in for a Generator whose every uniform rounds up to 1.0"""
+
+    def random(self, size):
+        return np.ones(size)
+
+
+@pytest.mark.parametrize("movement_strategy", list(MovementStrategy))
+def test_draw_at_total_picks_an_open_move(movement_strategy):
+    env = Environment(text=MAP)
+    agents = AgentArrays(1)
+    agents.x[:] = 1
+    agents.y[:] = 1
+    agents.familiarity[:] = 5
+    cells = EnvironmentArrays(env)
+    occupied = np.zeros(cells.size, dtype=bool)
+    occupied[cells.index(agents.x, agents.y)] = True
+
+    choice, moving = find_projected_moves(agents, cells, occupied, movement_strategy, TopDraws())
+
+    assert moving[0]
+    # Only right, down and down-right are open; down-left (7) is a wall
+    assert choice[0] == 4
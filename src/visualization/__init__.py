@@ -1,3 +1,6 @@
-from .video_visualization import VideoVisualization
-from .generic_visualization import GenericVisualization, StepData
+from .video_visualization import VideoVisualization, VideoRenderer
+from .generic_visualization import GenericVisualization, StepEvents, StopReason
+from .counting_visualization import CountingVisualization
 from .json_visualization import JsonVisualization
+from .results_visualization import ResultsVisualization
+from .trajectory import TrajectoryVisualization, TrajectoryReader
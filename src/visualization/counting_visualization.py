@@ -0,0 +1,45 @@
+from abc import abstractmethod
+from person import PersonStrategy
+from .generic_visualization import GenericVisualization, StepEvents, StopReason
+
+
+class CountingVisualization(GenericVisualization):
+    """
+    Base of the visualizers that only need, per step, the number of people
+    escaped so far and the strategy counts of everyone. Replicated runs call
+    record_counts directly; single runs rebuild the counts from the step events.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Running state rebuilt from the step events; escaped people keep
+        # counting with the strategy they escaped with
+        self.strategies: dict[int, PersonStrategy] = {}
+        self.strategy_count = {strategy: 0 for strategy in PersonStrategy}
+        self.escaped_count = 0
+        # Why the run ended, once it has
+        self.stop_reason: StopReason | None = None
+
+    def record_step(self, events: StepEvents):
+        for id_num, _, _, strategy in events.spawns:
+            self.strategies[id_num] = strategy
+            self.strategy_count[strategy] += 1
+        for id_num, strategy in events.strategy_flips:
+            self.strategy_count[self.strategies[id_num]] -= 1
+            self.strategy_count[strategy] += 1
+            self.strategies[id_num] = strategy
+        for id_num in events.escapes:
+            del self.strategies[id_num]
+        self.escaped_count += len(events.escapes)
+        self.record_counts(self.escaped_count, self.strategy_count)
+
+    def record_stop(self, reason: StopReason):
+        self.stop_reason = reason
+
+    @abstractmethod
+    def record_counts(self, escaped_count: int, strategy_count: dict[PersonStrategy, int]):
+        """
+        Record one step from the number of people escaped so far and the
+        strategy counts of everyone, escaped or not.
+        """
+        pass
@@ -1,19 +1,66 @@
 from abc import ABC, abstractmethod
+from enum import Enum
 
 
-class StepData:
-    def __init__(self, grid_state: list[list[str | object]], escaped_people: list[object]):
-        self.grid_state = [row.copy() for row in grid_state]
-        self.escaped_people = escaped_people.copy()
+class StopReason(Enum):
+    """Why a run ended"""
+    EVACUATED = 1
+    MAX_STEPS = 2
+    STALLED = 3
+    TIMEOUT = 4
+
+
+class StepEvents:
+    """
+    Everything that changed since the previous step, built once by the
+    simulation and shared by every visualizer. People are identified by
+    their id_num and cells by (x, y). Changes apply in this order:
+    spawns, strategy flips from the strategy update that ended the
+    previous step, moves, then escapes.
+    """
+
+    def __init__(self, step: int,
+                 spawns: list[tuple[int, int, int, object]] | None = None,
+                 strategy_flips: list[tuple[int, object]] | None = None,
+                 moves: list[tuple[int, int, int, int, int]] | None = None,
+                 escapes: list[int] | None = None,
+                 conflicts: list[tuple[int, bool]] | None = None):
+        self.step = step
+        # (id, x, y, strategy) of each person placed in the environment
+        self.spawns = spawns or []
+        # (id, new strategy)
+        self.strategy_flips = strategy_flips or []
+        # (id, from x, from y, to x, to y); moves onto an exit are included
+        self.moves = moves or []
+        # ids of the people whose move took them onto an exit
+        self.escapes = escapes or []
+        # (id, won) of everyone who played a conflict this step
+        self.conflicts = conflicts or []
 
 
 class GenericVisualization(ABC):
 
-    def __init__(self):
-        self.history: list[StepData] = []
+    def start(self, env):
+        """
+        Called once with the environment, before the first step is recorded.
+        Visualizers that draw the terrain copy what they need from it here.
+        """
+        pass
+
+    @abstractmethod
+    def record_step(self, events: StepEvents):
+        """
+        Record one step from its events. Visualizers that need the full
+        state rebuild it incrementally from these deltas.
+        """
+        pass
 
-    def record_step(self, step_data: StepData):
-        self.history.append(step_data)
+    def record_stop(self, reason: StopReason):
+        """
+        Called once after the last step, before export, with why the run
+        ended. Runs cut short leave people in the environment.
+        """
+        pass
 
     @abstractmethod
     def export(self, verbose):
@@ -1,61 +1,133 @@
-from .generic_visualization import GenericVisualization, StepData
+from .counting_visualization import CountingVisualization
+import gzip
 import json
-from person import Person, PersonStrategy
+import tempfile
+from person import PersonStrategy
 from person.person import MovementStrategy
 import os
 
+# Step records held in memory before they are appended to the steps file
+STEP_BUFFER_SIZE = 256
 
-class JsonVisualization(GenericVisualization):
-    def __init__(self, filename: str, environment_name: str, strategy: MovementStrategy):
+
+def open_text(filename: str, mode: str):
+    """Opens a text file, gzip compressed if the name ends in .gz"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+class JsonVisualization(CountingVisualization):
+    """
+    Streams one JSON record per step to a JSON Lines steps file as the run goes
+    and, on export, writes the out.json summary from it. Memory stays constant
+    however long the run is.
+    steps_filename keeps the steps file; otherwise a temporary one is used and
+    removed on export, or when the visualization is discarded if the run
+    failed. Either file is gzip compressed if its name ends in .gz, and is
+    only created once the first records are written.
+    """
+
+    def __init__(self, filename: str, environment_name: str, strategy: MovementStrategy,
+                 steps_filename: str | None = None):
         super().__init__()
         self.filename = filename
         self.environment_name = environment_name
         self.strategy = strategy.name
-        self.strategy_distribution = []
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-
-    def record_step(self, step_data: StepData):
-        super().record_step(step_data)
-        num_people = 0
-        strategy_count = {strategy: 0 for strategy in PersonStrategy}
-        for row in step_data.grid_state:
-            for item in row:
-                if isinstance(item, Person):
-                    num_people += 1
-                    strategy_count[item.strategy] += 1
-        for person in step_data.escaped_people:  # type: ignore
-            person: Person = person
-            num_people += 1
-            strategy_count[person.strategy] += 1
+        self.people_count = 0
+        self.steps = 0
+
+        self.keep_steps = steps_filename is not None
+        # A temporary steps file is named when the first records are written
+        self.steps_filename = steps_filename
+        self.steps_started = False
+        self.buffer: list[str] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        if steps_filename is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(steps_filename)), exist_ok=True)
+
+    def record_counts(self, escaped_count: int, strategy_count: dict[PersonStrategy, int]):
+        num_people = sum(strategy_count.values())
+        if self.steps == 0:
+            self.people_count = num_people - escaped_count
         if num_people > 0:
             distribution = {strategy.name: count /
                             num_people for strategy, count in strategy_count.items()}
         else:
             distribution = {strategy.name: 0.0 for strategy in PersonStrategy}
-        self.strategy_distribution.append(distribution)
+        self.buffer.append(json.dumps({
+            'step': self.steps,
+            'escaped': escaped_count,
+            'strategy_distribution': distribution
+        }))
+        self.steps += 1
+        if len(self.buffer) >= STEP_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered step records to the steps file"""
+        if not self.buffer:
+            return
+        if self.steps_filename is None:
+            fd, self.steps_filename = tempfile.mkstemp(
+                suffix='.jsonl', prefix='.steps-', dir=os.path.dirname(os.path.abspath(self.filename)))
+            os.close(fd)
+        # The first batch starts the file afresh; appending to a gzip file adds
+        # a new member, which readers handle
+        with open_text(self.steps_filename, 'a' if self.steps_started else 'w') as f:
+            f.write('\n'.join(self.buffer) + '\n')
+        self.steps_started = True
+        self.buffer = []
+
+    def read_steps(self):
+        """Yields the step records written so far"""
+        self.flush()
+        if self.steps_filename is None:
+            return
+        with open_text(self.steps_filename, 'r') as f:
+            for line in f:
+                yield json.loads(line)
 
     def export(self, verbose):
-        with open(self.filename, 'w') as f:
-            json.dump({
-                "environment": self.environment_name,
-                "people_count": self.get_people_count(),
-                "strategy": self.strategy,
-                'escape_time_history': self.get_escape_time_history(),
-                'strategy_distribution': self.strategy_distribution
-            }, f, indent=4)
+        # Same layout as json.dump(..., indent=4), but the two per-step lists
+        # are streamed from the steps file instead of held in memory
+        def write_list(f, key: str, field: str, last: bool):
+            f.write(f'    "{key}": [')
+            separator = '\n'
+            for record in self.read_steps():
+                item = json.dumps(record[field], indent=4).replace('\n', '\n        ')
+                f.write(f'{separator}        {item}')
+                separator = ',\n'
+            f.write(('\n    ]' if separator != '\n' else ']') + ('\n' if last else ',\n'))
+
+        try:
+            with open_text(self.filename, 'w') as f:
+                f.write('{\n')
+                f.write(f'    "environment": {json.dumps(self.environment_name)},\n')
+                f.write(f'    "people_count": {json.dumps(self.people_count)},\n')
+                f.write(f'    "strategy": {json.dumps(self.strategy)},\n')
+                # Runs cut short keep the escape time history up to where they stopped
+                f.write(f'    "stop_reason": {json.dumps(self.stop_reason.name if self.stop_reason else None)},\n')
+                write_list(f, 'escape_time_history', 'escaped', last=False)
+                write_list(f, 'strategy_distribution', 'strategy_distribution', last=True)
+                f.write('}')
+        finally:
+            self.remove_temporary_steps()
         if verbose:
             print("Saved evacuation data to " + self.filename)
 
-    def get_escape_time_history(self) -> list[int]:
-        return [len(h.escaped_people) for h in self.history]
+    def remove_temporary_steps(self):
+        """Delete the temporary steps file, if one was created"""
+        if not self.keep_steps and self.steps_filename is not None:
+            if os.path.exists(self.steps_filename):
+                os.remove(self.steps_filename)
+            self.steps_filename = None
+            self.steps_started = False
+
+    def __del__(self):
+        # A run that failed before export leaves no temporary file behind
+        self.remove_temporary_steps()
 
     def get_people_count(self) -> int:
-        if not self.history:
-            return 0
-        initial_step = self.history[0]
-        count = 0
-        for row in initial_step.grid_state:
-            for item in row:
-                if isinstance(item, Person):
-                    count += 1
-        return count
+        return self.people_count
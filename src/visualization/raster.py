@@ -0,0 +1,129 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+from environment import TileGrid
+from person import PersonStrategy
+
+# Matplotlib's 'green' and 'red', as drawn by the matplotlib renderer
+COOPERATE_COLOR = np.array([0, 128, 0], dtype=np.uint8)
+DEFECT_COLOR = np.array([255, 0, 0], dtype=np.uint8)
+MARK_COLOR = np.array([0, 0, 0], dtype=np.uint8)
+
+
+def make_sprites(cell_size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Boolean (cell_size, cell_size) masks of a person, a winner's ring and a
+    loser's X, with the proportions the matplotlib renderer uses.
+    """
+    u = np.arange(cell_size) + 0.5 - cell_size / 2
+    dx, dy = np.meshgrid(u, u)
+    distance = np.sqrt(dx * dx + dy * dy)
+    line = max(0.75, cell_size / 24)
+    body = distance <= 0.4 * cell_size
+    ring = np.abs(distance - 0.125 * cell_size) <= line
+    arm = 0.125 * cell_size + line
+    cross = (np.abs(dx) <= arm) & (np.abs(dy) <= arm) & (
+        np.abs(np.abs(dx) - np.abs(dy)) <= line)
+    return body, ring, cross
+
+
+class RasterRenderer:
+    """
+    Rasterizes frames straight into uint8 RGB arrays, each cell scaled to
+    cell_size pixels, stamping every person's sprite at once. The frame is
+    reused between calls: only the tiles drawn on last frame are restored to
+    the background before the next one is stamped.
+    """
+
+    def __init__(self, img: np.ndarray, cell_size: int):
+        if cell_size < 2 or cell_size % 2:
+            # libx264 with yuv420p needs even frame dimensions
+            raise ValueError("the raster cell size must be an even number of pixels")
+        self.cell_size = cell_size
+        self.background = np.repeat(
+            np.repeat(img, cell_size, axis=0), cell_size, axis=1)
+        self.height, self.width = self.background.shape[:2]
+        self.body, self.ring, self.cross = make_sprites(cell_size)
+        self.frame = self.background.copy()
+        self.tiles = TileGrid(self.width // cell_size, self.height // cell_size)
+        # Tiles of the frame holding sprites from the last render
+        self.drawn = np.zeros(0, dtype=np.intp)
+
+    def _stamp(self, frame: np.ndarray, cells: np.ndarray, mask: np.ndarray, colors: np.ndarray):
+        """Paints mask in colors (one per cell, or a single color) over the given (x, y) cells"""
+        if len(cells) == 0:
+            return
+        c = self.cell_size
+        # (rows, columns, cell_size, cell_size, 3) view of the frame's cells
+        blocks = frame.reshape(self.height // c, c, self.width // c, c, 3).transpose(0, 2, 1, 3, 4)
+        x, y = cells[:, 0], cells[:, 1]
+        colors = colors.reshape(-1, 1, 1, 3)
+        blocks[y, x] = np.where(mask[None, :, :, None], colors, blocks[y, x])
+
+    def render_frame(self, frame_data, frame_index: int) -> np.ndarray:
+        """render() for a FrameData. Raster frames have no title, so the index is unused."""
+        return self.render(frame_data.people, frame_data.winners, frame_data.losers)
+
+    def render(self, people: np.ndarray, winners: np.ndarray, losers: np.ndarray) -> np.ndarray:
+        """
+        people holds (x, y, strategy value) rows; winners and losers hold (x, y).
+        Returns a (height, width, 3) uint8 frame, which the next call overwrites.
+        """
+        frame = self.frame
+        if len(self.drawn) * 2 > self.tiles.rows * self.tiles.columns:
+            np.copyto(frame, self.background)
+        else:
+            c = self.cell_size
+            for tile in self.drawn.tolist():
+                rows, columns = self.tiles.cells(tile)
+                rows = slice(rows.start * c, rows.stop * c)
+                columns = slice(columns.start * c, columns.stop * c)
+                frame[rows, columns] = self.background[rows, columns]
+        cells = np.concatenate([people[:, :2], winners.reshape(-1, 2), losers.reshape(-1, 2)]).astype(np.intp)
+        self.drawn = np.unique(self.tiles.tile(cells[:, 0], cells[:, 1]))
+        colors = np.where((people[:, 2] == PersonStrategy.COOPERATE.value)[:, None],
+                          COOPERATE_COLOR, DEFECT_COLOR).astype(np.uint8)
+        self._stamp(frame, people, self.body, colors)
+        self._stamp(frame, winners, self.ring, MARK_COLOR)
+        self._stamp(frame, losers, self.cross, MARK_COLOR)
+        return frame
+
+
+def open_ffmpeg(filename: str, width: int, height: int, fps: int) -> subprocess.Popen:
+    """Starts ffmpeg encoding raw RGB frames written to its stdin into filename"""
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg was not found on the PATH")
+    return subprocess.Popen(
+        ['ffmpeg', '-y', '-loglevel', 'error',
+         '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+         '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', filename],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def close_ffmpeg(process: subprocess.Popen):
+    """Finishes the stream and raises if ffmpeg failed"""
+    assert process.stdin is not None and process.stderr is not None
+    process.stdin.close()
+    error = process.stderr.read().decode(errors='replace')
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed:\n{error}")
+
+
+def concat_ffmpeg(segments: list[str], filename: str):
+    """Joins segments encoded with the same settings into filename without re-encoding"""
+    list_filename = filename + '.segments.txt'
+    with open(list_filename, 'w') as f:
+        for segment in segments:
+            path = os.path.abspath(segment).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', list_filename, '-c', 'copy', filename],
+            capture_output=True)
+    finally:
+        os.remove(list_filename)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed:\n{result.stderr.decode(errors='replace')}")
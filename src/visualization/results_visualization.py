@@ -0,0 +1,39 @@
+import numpy as np
+from person import PersonStrategy
+from .counting_visualization import CountingVisualization
+
+
+class ResultsVisualization(CountingVisualization):
+    """
+    Keeps the escape time history and per-step strategy counts of a run in
+    memory, for batches that store results in a ResultsStore instead of
+    writing an out.json per run.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.people_count = 0
+        self.steps = 0
+        self.escape_time_history: list[int] = []
+        # Per step, the number of people with each strategy in PersonStrategy order
+        self.strategy_counts: list[list[int]] = []
+
+    def record_counts(self, escaped_count: int, strategy_count: dict[PersonStrategy, int]):
+        if self.steps == 0:
+            self.people_count = sum(strategy_count.values()) - escaped_count
+        self.escape_time_history.append(escaped_count)
+        self.strategy_counts.append([strategy_count[strategy] for strategy in PersonStrategy])
+        self.steps += 1
+
+    def export(self, verbose):
+        pass
+
+    def result(self) -> dict:
+        """The run's columns of a ResultsStore row"""
+        return {
+            "people_count": self.people_count,
+            "steps": self.steps,
+            "stop_reason": self.stop_reason.name if self.stop_reason else None,
+            "escape_time_history": np.array(self.escape_time_history, dtype=np.int32),
+            "strategy_counts": np.array(self.strategy_counts, dtype=np.int32).reshape(-1, len(PersonStrategy)),
+        }
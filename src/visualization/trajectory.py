@@ -0,0 +1,236 @@
+import json
+import os
+import numpy as np
+from person import PersonStrategy, PersonGameState, MovementStrategy
+from .generic_visualization import GenericVisualization, StepEvents, StopReason
+
+TRAJECTORY_VERSION = 2
+
+# One row per person per step. Rows of a step are sorted by id and cover the
+# people in the environment after the step plus those who escaped during it,
+# who are left on their exit cell with escaped set.
+COLUMNS = {
+    'id': np.dtype('<i4'),
+    'x': np.dtype('<u2'),
+    'y': np.dtype('<u2'),
+    'strategy': np.dtype('i1'),
+    'game_state': np.dtype('i1'),
+    'escaped': np.dtype('?'),
+}
+# Per step: the end of its rows and the number of people escaped so far
+INDEX_DTYPE = np.dtype('<i8')
+
+STRATEGIES = {strategy.value: strategy for strategy in PersonStrategy}
+
+
+class TrajectoryVisualization(GenericVisualization):
+    """
+    Records the state of every person at every step into a directory of
+    columnar binary files, written in chunks of steps as the run goes.
+    TrajectoryReader replays it without rerunning the simulation.
+    """
+
+    def __init__(self, path: str, environment_name: str, movement_strategy: MovementStrategy | None = None,
+                 chunk_steps: int = 64):
+        super().__init__()
+        self.path = path
+        self.environment_name = environment_name
+        self.movement_strategy = movement_strategy
+        self.chunk_steps = chunk_steps
+        self.width = 0
+        self.height = 0
+        # Live people as id -> (x, y, strategy), rebuilt from the step events
+        self.people: dict[int, tuple[int, int, PersonStrategy]] = {}
+        self.steps = 0
+        self.rows = 0
+        self.escaped_count = 0
+        self.stop_reason: StopReason | None = None
+        self.chunk: list[np.ndarray] = []
+        self.chunk_index: list[tuple[int, int]] = []
+        os.makedirs(self.path, exist_ok=True)
+
+    def start(self, env):
+        if max(env.width, env.height) > np.iinfo(COLUMNS['x']).max:
+            raise ValueError(
+                f"environments wider or taller than {np.iinfo(COLUMNS['x']).max} cells cannot be recorded")
+        self.width = env.width
+        self.height = env.height
+        np.save(os.path.join(self.path, 'terrain.npy'), np.asarray(env.terrain))
+        for name in list(COLUMNS) + ['index']:
+            open(os.path.join(self.path, f'{name}.bin'), 'wb').close()
+
+    def record_step(self, events: StepEvents):
+        for id_num, x, y, strategy in events.spawns:
+            self.people[id_num] = (x, y, strategy)
+        for id_num, strategy in events.strategy_flips:
+            x, y, _ = self.people[id_num]
+            self.people[id_num] = (x, y, strategy)
+        for id_num, _, _, x, y in events.moves:
+            self.people[id_num] = (x, y, self.people[id_num][2])
+
+        game_states = {id_num: (PersonGameState.WON if won else PersonGameState.LOST).value
+                       for id_num, won in events.conflicts}
+        escapes = set(events.escapes)
+        rows = np.array([(id_num, x, y, strategy.value,
+                          game_states.get(id_num, PersonGameState.NOT_PLAYED.value), id_num in escapes)
+                         for id_num, (x, y, strategy) in self.people.items()],
+                        dtype=[(name, dtype) for name, dtype in COLUMNS.items()])
+        rows.sort(order='id')
+        for id_num in events.escapes:
+            del self.people[id_num]
+
+        self.rows += len(rows)
+        self.escaped_count += len(escapes)
+        self.steps += 1
+        self.chunk.append(rows)
+        self.chunk_index.append((self.rows, self.escaped_count))
+        if len(self.chunk) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered steps to the column files"""
+        if not self.chunk:
+            return
+        rows = np.concatenate(self.chunk)
+        for name in COLUMNS:
+            with open(os.path.join(self.path, f'{name}.bin'), 'ab') as f:
+                f.write(np.ascontiguousarray(rows[name]).tobytes())
+        with open(os.path.join(self.path, 'index.bin'), 'ab') as f:
+            f.write(np.array(self.chunk_index, dtype=INDEX_DTYPE).tobytes())
+        self.chunk = []
+        self.chunk_index = []
+
+    def record_stop(self, reason: StopReason):
+        self.stop_reason = reason
+
+    def export(self, verbose):
+        self.flush()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': TRAJECTORY_VERSION,
+                'environment': self.environment_name,
+                'movement': self.movement_strategy.name if self.movement_strategy else None,
+                'width': self.width,
+                'height': self.height,
+                'steps': self.steps,
+                'stop_reason': self.stop_reason.name if self.stop_reason else None,
+                'rows': self.rows,
+                'columns': {name: dtype.str for name, dtype in COLUMNS.items()}
+            }, f, indent=4)
+        if verbose:
+            print("Saved trajectory to " + self.path)
+
+
+class TrajectoryStep:
+    """The rows of one recorded step, as read-only column arrays"""
+
+    def __init__(self, step: int, escaped_count: int, columns: dict[str, np.ndarray]):
+        self.step = step
+        # People escaped by the end of this step
+        self.escaped_count = escaped_count
+        self.id = columns['id']
+        self.x = columns['x']
+        self.y = columns['y']
+        self.strategy = columns['strategy']
+        self.game_state = columns['game_state']
+        self.escaped = columns['escaped']
+
+
+class TrajectoryReader:
+    """
+    Memory-maps a trajectory written by TrajectoryVisualization. Any step can
+    be read directly, and the run can be replayed into other visualizers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != TRAJECTORY_VERSION:
+            raise ValueError(
+                f"{path} is trajectory version {meta['version']}, expected {TRAJECTORY_VERSION}")
+        self.environment_name: str = meta['environment']
+        # None if the recorder was not told the movement strategy
+        movement = meta['movement']
+        self.movement_strategy: MovementStrategy | None = MovementStrategy[movement] if movement else None
+        self.width: int = meta['width']
+        self.height: int = meta['height']
+        self.steps: int = meta['steps']
+        stop_reason = meta['stop_reason']
+        self.stop_reason: StopReason | None = StopReason[stop_reason] if stop_reason else None
+        self.terrain = np.load(os.path.join(path, 'terrain.npy'), mmap_mode='r')
+        self.columns = {name: self._map(name, np.dtype(dtype), meta['rows'])
+                        for name, dtype in meta['columns'].items()}
+        self.index = self._map('index', INDEX_DTYPE, 2 * self.steps).reshape(self.steps, 2)
+
+    def _map(self, name: str, dtype: np.dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return self.steps
+
+    def step(self, step: int) -> TrajectoryStep:
+        if not 0 <= step < self.steps:
+            raise IndexError(f"step {step} out of range for {self.steps} steps")
+        start = int(self.index[step - 1, 0]) if step > 0 else 0
+        end = int(self.index[step, 0])
+        return TrajectoryStep(step, int(self.index[step, 1]),
+                              {name: column[start:end] for name, column in self.columns.items()})
+
+    def escape_time_history(self) -> np.ndarray:
+        """The number of people escaped by the end of each step"""
+        return np.asarray(self.index[:, 1])
+
+    def events(self, step: int) -> StepEvents:
+        """Rebuilds the StepEvents a visualizer saw at this step"""
+        current = self.step(step)
+        played = current.game_state != PersonGameState.NOT_PLAYED.value
+        conflicts = list(zip(current.id[played].tolist(),
+                             (current.game_state[played] == PersonGameState.WON.value).tolist()))
+        escapes = current.id[current.escaped].tolist()
+        if step == 0:
+            spawns = [(id_num, x, y, STRATEGIES[strategy]) for id_num, x, y, strategy in zip(
+                current.id.tolist(), current.x.tolist(), current.y.tolist(), current.strategy.tolist())]
+            return StepEvents(0, spawns=spawns, escapes=escapes, conflicts=conflicts)
+
+        # Everyone in this step was live at the end of the previous one,
+        # and both are sorted by id
+        previous = self.step(step - 1)
+        live = ~previous.escaped
+        match = np.searchsorted(previous.id[live], current.id)
+        old_x = previous.x[live][match]
+        old_y = previous.y[live][match]
+        flipped = previous.strategy[live][match] != current.strategy
+        moved = (old_x != current.x) | (old_y != current.y)
+        flips = [(id_num, STRATEGIES[strategy]) for id_num, strategy in zip(
+            current.id[flipped].tolist(), current.strategy[flipped].tolist())]
+        moves = list(zip(current.id[moved].tolist(), old_x[moved].tolist(), old_y[moved].tolist(),
+                         current.x[moved].tolist(), current.y[moved].tolist()))
+        return StepEvents(step, strategy_flips=flips, moves=moves, escapes=escapes, conflicts=conflicts)
+
+    def replay(self, visualizers: list[GenericVisualization], verbose=False, start: int = 0, stop: int | None = None):
+        """
+        Feeds steps start to stop of the run to visualizers as if the simulation
+        were running, then exports them. When start is past step 0, the people
+        live at the end of the step before it are spawned first, so counters
+        such as the number escaped begin from zero at start.
+        """
+        stop = self.steps if stop is None else min(stop, self.steps)
+        for visualizer in visualizers:
+            visualizer.start(self)
+        if start > 0:
+            previous = self.step(start - 1)
+            live = ~previous.escaped
+            spawns = [(id_num, x, y, STRATEGIES[strategy]) for id_num, x, y, strategy in zip(
+                previous.id[live].tolist(), previous.x[live].tolist(), previous.y[live].tolist(),
+                previous.strategy[live].tolist())]
+            events = StepEvents(start - 1, spawns=spawns)
+            [visualizer.record_step(events) for visualizer in visualizers]
+        for step in range(start, stop):
+            events = self.events(step)
+            [visualizer.record_step(events) for visualizer in visualizers]
+        if stop == self.steps and self.stop_reason is not None:
+            [visualizer.record_stop(self.stop_reason) for visualizer in visualizers]
+        [visualizer.export(verbose) for visualizer in visualizers]
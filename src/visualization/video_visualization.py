@@ -1,66 +1,160 @@
-from matplotlib import pyplot as plt
-from matplotlib.animation import FFMpegWriter
-from matplotlib import animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imsave
 import numpy as np
-from person import Person, PersonGameState, PersonStrategy
-from .generic_visualization import GenericVisualization, StepData
+from person import PersonStrategy
+from .generic_visualization import GenericVisualization, StepEvents
+from .raster import RasterRenderer, open_ffmpeg, close_ffmpeg, concat_ffmpeg
 from matplotlib.patches import Circle
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
 import os
 
+# Fewest frames worth handing to a worker process of their own
+MIN_CHUNK_FRAMES = 32
+
+
+class VideoRenderer(Enum):
+    MATPLOTLIB = 1  # publication quality, slow
+    RASTER = 2  # frames rasterized with NumPy and piped to ffmpeg
+
 
 class FrameData:
-    def __init__(self, people: list[tuple[int, int, PersonStrategy]], img: np.ndarray, escaped_count: int,
-                 winners: list[tuple[int, int]], losers: list[tuple[int, int]]):
+    def __init__(self, people: np.ndarray, img: np.ndarray, escaped_count: int,
+                 winners: np.ndarray, losers: np.ndarray):
+        # (x, y, strategy value) rows
         self.people = people
         self.img = img
         self.escaped_count = escaped_count
-        self.winners: list[tuple[int, int]] = winners
-        self.losers: list[tuple[int, int]] = losers
+        # (x, y) rows
+        self.winners = winners
+        self.losers = losers
+
+
+class MatplotlibRenderer:
+    """Draws frames with matplotlib patches on an off-screen canvas"""
+
+    def __init__(self, img: np.ndarray):
+        self.img = img
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.subplots()
+        self.width, self.height = self.canvas.get_width_height()
+
+    def render_frame(self, frame_data: FrameData, frame_index: int) -> np.ndarray:
+        radius = 0.4
+        winner_radius = 0.125
+        strategy_indicator_width = 1.0
+        x_size = 0.125
+        ax = self.ax
+
+        ax.clear()
+        ax.imshow(frame_data.img)
+        ax.set_title(
+            f'Step {frame_index}, Escaped: {frame_data.escaped_count}')
+
+        # Draw people as circles
+        for x, y, strategy in frame_data.people.tolist():
+            color = 'green' if strategy == PersonStrategy.COOPERATE.value else 'red'
+            ax.add_patch(Circle((x, y), radius, fill=True,
+                                facecolor=color, edgecolor='none'))
+
+        # Draw small black circles for winners
+        for x, y in frame_data.winners.tolist():
+            ax.add_patch(Circle((x, y), winner_radius, fill=False,
+                                edgecolor='black', linewidth=strategy_indicator_width))
+
+        # Draw X marks for losers
+        for x, y in frame_data.losers.tolist():
+            ax.plot([x - x_size, x + x_size], [y - x_size, y + x_size],
+                    color='black', linewidth=strategy_indicator_width)
+            ax.plot([x - x_size, x + x_size], [y + x_size, y - x_size],
+                    color='black', linewidth=strategy_indicator_width)
+
+        ax.axis('off')
+        self.canvas.draw()
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3]
+
+
+def render_segment(renderer: VideoRenderer, img: np.ndarray, cell_size: int, frames: list[FrameData],
+                   first_index: int, filename: str, fps: int, frames_dir: str | None):
+    """
+    Renders a contiguous chunk of frames and encodes them into filename.
+    With frames_dir, each rendered buffer is also saved as a PNG.
+    Runs in a worker process, so it only takes picklable arguments.
+    """
+    if renderer == VideoRenderer.RASTER:
+        drawer = RasterRenderer(img, cell_size)
+    else:
+        drawer = MatplotlibRenderer(img)
+    process = open_ffmpeg(filename, drawer.width, drawer.height, fps)
+    assert process.stdin is not None
+    try:
+        for frame_index, frame_data in enumerate(frames, start=first_index):
+            frame = drawer.render_frame(frame_data, frame_index)
+            process.stdin.write(frame.tobytes())
+            if frames_dir is not None:
+                imsave(os.path.join(frames_dir, f'{frame_index:04d}.png'), frame)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; close_ffmpeg reports why
+    close_ffmpeg(process)
 
 
 class VideoVisualization(GenericVisualization):
-    def __init__(self, filename: str, fps: int, export_frames: bool, verbose: bool):
+    def __init__(self, filename: str, fps: int, export_frames: bool, verbose: bool,
+                 renderer: VideoRenderer = VideoRenderer.MATPLOTLIB, cell_size: int = 8,
+                 workers: int = 1):
         super().__init__()
         self.filename = filename
         self.fps = fps
+        self.renderer = renderer
+        # Pixels per cell for the raster renderer
+        self.cell_size = cell_size
+        # Processes rendering the video on export in parallel chunks
+        self.workers = workers
         self.frame_data: list[FrameData] = []
+        # Live people as id -> (x, y, strategy), rebuilt from the step events
+        self.people: dict[int, tuple[int, int, PersonStrategy]] = {}
+        self.escaped_count = 0
+        self.img = np.zeros((0, 0, 3), dtype=np.uint8)
         self.export_frames = export_frames
         self.verbose = verbose
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+
+    def start(self, env):
+        # The terrain never changes and people are drawn as patches on top of
+        # it, so every frame shares one background image
+        terrain = np.asarray(env.terrain)
+        self.img = np.full((env.height, env.width, 3), 255, dtype=np.uint8)
+        self.img[terrain == ord('#')] = [0, 0, 0]    # Black for obstacles
+        self.img[terrain == ord('E')] = [0, 255, 0]  # Green for exits
+
+    def record_step(self, events: StepEvents):
+        for id_num, x, y, strategy in events.spawns:
+            self.people[id_num] = (x, y, strategy)
+        for id_num, strategy in events.strategy_flips:
+            x, y, _ = self.people[id_num]
+            self.people[id_num] = (x, y, strategy)
+        for id_num, _, _, x, y in events.moves:
+            self.people[id_num] = (x, y, self.people[id_num][2])
+        for id_num in events.escapes:
+            del self.people[id_num]
+        self.escaped_count += len(events.escapes)
 
-    def record_step(self, step_data: StepData):
-        super().record_step(step_data)
         winners: list[tuple[int, int]] = []
         losers: list[tuple[int, int]] = []
-        people: list[tuple[int, int, PersonStrategy]] = []
-        escaped_count = len(step_data.escaped_people)
-        height = len(step_data.grid_state)
-        width = len(step_data.grid_state[0]) if height > 0 else 0
-        img = np.zeros((height, width, 3), dtype=np.uint8)
-
-        for y, row in enumerate(step_data.grid_state):
-            for x, cell in enumerate(row):
-                if cell == ' ' or cell == 'S':
-                    img[y, x] = [255, 255, 255]  # White for empty space
-                elif cell == '#':
-                    img[y, x] = [0, 0, 0]        # Black for obstacles
-                elif cell == 'E':
-                    img[y, x] = [0, 255, 0]      # Green for exits
-                elif isinstance(cell, Person):
-                    # White background for person location
-                    img[y, x] = [255, 255, 255]
-                    people.append((x, y, cell.strategy))
-                    if cell.game_state == PersonGameState.WON:
-                        winners.append((x, y))
-                    elif cell.game_state == PersonGameState.LOST:
-                        losers.append((x, y))
+        for id_num, won in events.conflicts:
+            if id_num in self.people:
+                x, y, _ = self.people[id_num]
+                (winners if won else losers).append((x, y))
 
         self.frame_data.append(FrameData(
-            people=people,
-            img=img,
-            escaped_count=escaped_count,
-            winners=winners,
-            losers=losers
+            people=np.array([(x, y, strategy.value) for x, y, strategy in self.people.values()],
+                            dtype=np.int32).reshape(-1, 3),
+            img=self.img,
+            escaped_count=self.escaped_count,
+            winners=np.array(winners, dtype=np.int32).reshape(-1, 2),
+            losers=np.array(losers, dtype=np.int32).reshape(-1, 2)
         ))
         if self.verbose:
             print(
@@ -68,49 +162,28 @@ class VideoVisualization(GenericVisualization):
             )
 
     def export(self, verbose):
-        # create an animation of the evacuation process
-        fig, ax = plt.subplots()
-        radius = 0.4
-        winner_radius = 0.125
-        strategy_indicator_width = 1.0
-        x_size = 0.125
-
-        # Create animation using precomputed frames
-        def update(frame_index: int):
-            ax.clear()
-            frame_data = self.frame_data[frame_index]
-            image = ax.imshow(frame_data.img)
-            ax.set_title(
-                f'Step {frame_index}, Escaped: {frame_data.escaped_count}')
-
-            # Draw people as circles
-            for x, y, strategy in frame_data.people:
-                color = 'green' if strategy == PersonStrategy.COOPERATE else 'red'
-                ax.add_patch(Circle((x, y), radius, fill=True,
-                                    facecolor=color, edgecolor='none'))
-
-            # Draw small black circles for winners
-            for x, y in frame_data.winners:
-                ax.add_patch(Circle((x, y), winner_radius, fill=False,
-                                    edgecolor='black', linewidth=strategy_indicator_width))
-
-            # Draw X marks for losers
-            for x, y in frame_data.losers:
-                ax.plot([x - x_size, x + x_size], [y - x_size, y + x_size],
-                        color='black', linewidth=strategy_indicator_width)
-                ax.plot([x - x_size, x + x_size], [y + x_size, y - x_size],
-                        color='black', linewidth=strategy_indicator_width)
-
-            ax.axis('off')
-            if self.export_frames:
-                plt.savefig(
-                    f'{os.path.dirname(self.filename)}/{frame_index:04d}.png')
-            return [image]
-
-        interval = 1000 / self.fps
-        ani = animation.FuncAnimation(
-            fig, update, frames=len(self.frame_data), interval=interval)
-        ani.save(self.filename, writer=FFMpegWriter(fps=self.fps))
-        plt.close()
+        frame_count = len(self.frame_data)
+        frames_dir = os.path.dirname(self.filename) if self.export_frames else None
+        workers = min(self.workers, max(1, frame_count // MIN_CHUNK_FRAMES))
+        if workers == 1:
+            render_segment(self.renderer, self.img, self.cell_size, self.frame_data,
+                           0, self.filename, self.fps, frames_dir)
+        else:
+            # Contiguous chunks rendered and encoded in parallel, then joined
+            # without re-encoding
+            bounds = np.linspace(0, frame_count, workers + 1).astype(int).tolist()
+            base, extension = os.path.splitext(self.filename)
+            segments = [f'{base}.part{chunk}{extension}' for chunk in range(workers)]
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(render_segment, self.renderer, self.img, self.cell_size,
+                                               self.frame_data[start:end], start, segment, self.fps, frames_dir)
+                               for start, end, segment in zip(bounds, bounds[1:], segments)]
+                    [future.result() for future in futures]
+                concat_ffmpeg(segments, self.filename)
+            finally:
+                for segment in segments:
+                    if os.path.exists(segment):
+                        os.remove(segment)
         if verbose:
             print("Saved evacuation video to " + self.filename)